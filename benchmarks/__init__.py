@@ -0,0 +1,44 @@
+"""
+Benchmarks for parsing and evaluating drug resistance rules
+
+Run the whole suite from the top of the repository, and write the results
+as JSON to compare between releases:
+
+    python -m benchmarks --output results.json
+
+Smaller benchmarks can be run on their own, for example:
+
+    python -m benchmarks.residues
+"""
+import os
+
+from pyvdrm.vcf import AMINO_ALPHABET, VariantCalls
+
+RULES_PATH = os.path.join(os.path.dirname(__file__),
+                          os.pardir,
+                          'pyvdrm',
+                          'tests',
+                          'HIVDB.rules')
+
+
+def read_rules(path=RULES_PATH):
+    """Read one rule string per line"""
+    with open(path) as rules_file:
+        return [line for line in rules_file if line.strip()]
+
+
+def synthetic_reference(rng, length=400):
+    """Random wild type long enough for every position in HIVDB.rules"""
+    return ''.join(rng.choice(AMINO_ALPHABET) for _ in range(length))
+
+
+def synthetic_calls(rng, reference, density=0.02):
+    """ Make VariantCalls that cover every position of the reference.
+
+    :param random.Random rng: seeded source of random numbers
+    :param str reference: wild type amino acids
+    :param float density: fraction of positions that have a random variant
+    """
+    sample = [rng.choice(AMINO_ALPHABET) if rng.random() < density else wt
+              for wt in reference]
+    return VariantCalls(reference=reference, sample=sample)
@@ -0,0 +1,57 @@
+"""
+Run the benchmark suite and write the results as JSON
+"""
+import json
+import sys
+from argparse import ArgumentParser, FileType
+
+from benchmarks.suite import MODES, PARSERS, run_suite
+
+
+def parse_args():
+    parser = ArgumentParser(
+        description='Benchmark parsing and scoring with pyvdrm.')
+    parser.add_argument('-o',
+                        '--output',
+                        type=FileType('w'),
+                        default=sys.stdout,
+                        help='JSON file to write, default stdout')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--lengths',
+                        type=int,
+                        nargs='+',
+                        default=[400, 1000, 3000],
+                        help='reference lengths to generate')
+    parser.add_argument('--densities',
+                        type=float,
+                        nargs='+',
+                        default=[0.0, 0.01, 0.05],
+                        help='fraction of positions with a mutation')
+    parser.add_argument('--cohort-size', type=int, default=200)
+    parser.add_argument('--parse-repeat', type=int, default=3)
+    parser.add_argument('--parsers',
+                        nargs='+',
+                        choices=sorted(PARSERS),
+                        default=sorted(PARSERS))
+    parser.add_argument('--modes',
+                        nargs='+',
+                        choices=list(MODES),
+                        default=list(MODES))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = run_suite(seed=args.seed,
+                       lengths=args.lengths,
+                       densities=args.densities,
+                       cohort_size=args.cohort_size,
+                       parse_repeat=args.parse_repeat,
+                       parsers=args.parsers,
+                       modes=args.modes)
+    json.dump(report, args.output, indent=2)
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Count the Score objects that are allocated while evaluating rules
+
+The counts for the working tree are reported next to the counts for an
+earlier revision of pyvdrm, which is extracted from git and measured in a
+separate interpreter:
+
+    python -m benchmarks.allocations --baseline <revision>
+
+The baseline defaults to the first commit in the repository.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tarfile
+from argparse import ArgumentParser
+from io import BytesIO
+from tempfile import TemporaryDirectory
+
+from benchmarks import read_rules, synthetic_calls, synthetic_reference
+
+REPOSITORY = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def count_scores(module, rules, samples):
+    """Count new Score objects per rule evaluated with full residues"""
+    created = 0
+    original_init = module.Score.__init__
+
+    def counting_init(self, *args, **kwargs):
+        nonlocal created
+        created += 1
+        original_init(self, *args, **kwargs)
+
+    module.Score.__init__ = counting_init
+    try:
+        for sample in samples:
+            for rule in rules:
+                rule.dtree(sample)
+    finally:
+        module.Score.__init__ = original_init
+    return created / (len(rules) * len(samples))
+
+
+def score_size(module):
+    """Bytes held by a single Score, not counting its residues"""
+    score = module.Score(10, set())
+    size = sys.getsizeof(score)
+    if hasattr(score, '__dict__'):
+        size += sys.getsizeof(score.__dict__)
+    return size
+
+
+def measure(seed=42):
+    """Count Score objects with whichever pyvdrm is imported
+
+    :return: {parser name: [Score objects per rule, bytes per Score]}
+    """
+    from pyvdrm import asi2, hcvr
+    rng = random.Random(seed)
+    reference = synthetic_reference(rng)
+    samples = [synthetic_calls(rng, reference) for _ in range(20)]
+    results = {}
+    for module, parser_class in ((asi2, asi2.ASI2), (hcvr, hcvr.HCVR)):
+        rules = [parser_class(rule) for rule in read_rules()]
+        results[parser_class.__name__] = [count_scores(module, rules, samples),
+                                          score_size(module)]
+    return results
+
+
+def first_commit():
+    return subprocess.run(['git', 'rev-list', '--max-parents=0', 'HEAD'],
+                          cwd=REPOSITORY,
+                          check=True,
+                          stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.split()[-1]
+
+
+def measure_revision(revision, seed=42):
+    """Extract pyvdrm from a git revision, and measure it in a new process"""
+    archive = subprocess.run(['git', 'archive', revision, 'pyvdrm'],
+                             cwd=REPOSITORY,
+                             check=True,
+                             stdout=subprocess.PIPE).stdout
+    with TemporaryDirectory() as folder:
+        with tarfile.open(fileobj=BytesIO(archive)) as tar:
+            tar.extractall(folder)
+        # the old pyvdrm comes first, and the benchmarks come from here
+        path = os.pathsep.join([folder, os.path.abspath(REPOSITORY)])
+        env = dict(os.environ, PYTHONPATH=path)
+        output = subprocess.run([sys.executable,
+                                 '-m',
+                                 'benchmarks.allocations',
+                                 '--json',
+                                 '--seed',
+                                 str(seed)],
+                                cwd=folder,
+                                env=env,
+                                check=True,
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+    return json.loads(output)
+
+
+def parse_args():
+    parser = ArgumentParser(
+        description='Count Score objects before and after a change.')
+    parser.add_argument('--baseline',
+                        help='git revision to compare with, default the '
+                             'first commit')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='only measure the imported pyvdrm, as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.json:
+        print(json.dumps(measure(args.seed)))
+        return
+    baseline = args.baseline or first_commit()
+    before = measure_revision(baseline, args.seed)
+    after = measure(args.seed)
+    for name, (after_count, after_size) in after.items():
+        before_count, before_size = before[name]
+        print('{}: {:.1f} Score objects per rule, {} bytes each at {}; '
+              '{:.1f} per rule, {} bytes each now'.format(name,
+                                                          before_count,
+                                                          before_size,
+                                                          baseline[:7],
+                                                          after_count,
+                                                          after_size))
+
+
+if __name__ == '__main__':
+    main()
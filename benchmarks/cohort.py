@@ -0,0 +1,38 @@
+"""
+Measure how cohort evaluation scales with the number of worker processes
+"""
+import os
+import random
+from time import perf_counter
+
+from pyvdrm.cohort import evaluate_cohort
+
+from benchmarks import read_rules, synthetic_calls, synthetic_reference
+
+
+def measure(rules, samples, workers):
+    """Measure samples per second through the whole rule bank"""
+    start = perf_counter()
+    for _ in evaluate_cohort(rules, samples, workers=workers):
+        pass
+    return len(samples) / (perf_counter() - start)
+
+
+def main():
+    rng = random.Random(42)
+    reference = synthetic_reference(rng)
+    samples = [synthetic_calls(rng, reference) for _ in range(5000)]
+    rules = {str(i): rule for i, rule in enumerate(read_rules())}
+    baseline = measure(rules, samples, workers=0)
+    print('in process: {:.0f} samples/s'.format(baseline))
+    workers = 1
+    while workers <= os.cpu_count():
+        rate = measure(rules, samples, workers)
+        print('{} workers: {:.0f} samples/s ({:.1f}x)'.format(workers,
+                                                             rate,
+                                                             rate / baseline))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure how long a fresh process takes to import pyvdrm and load rules
+
+Short-lived batch jobs pay these costs on every run, so each scenario starts
+a new interpreter and times the scenario's code inside it.
+"""
+import os
+import subprocess
+import sys
+from statistics import median
+from tempfile import TemporaryDirectory
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.ir import dump_rules
+
+from benchmarks import RULES_PATH, read_rules
+
+SCENARIOS = {
+    'import vcf': 'import pyvdrm.vcf',
+    'import asi2': 'import pyvdrm.asi2',
+    'load IR bank': '''\
+from pyvdrm.ir import load_rules
+with open(ir_path) as f:
+    load_rules(f)''',
+    'parse rules': '''\
+from pyvdrm.asi2 import ASI2
+with open(rules_path) as f:
+    [ASI2(line) for line in f if line.strip()]'''}
+
+CHILD = '''\
+import sys, time
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+print(seconds, 'pyparsing' in sys.modules, 'numpy' in sys.modules)
+'''
+
+
+def time_scenario(code, repeat, **paths):
+    """Run code in new interpreters, and find the median time it took"""
+    setup = ''.join('{} = {!r}\n'.format(name, path)
+                    for name, path in paths.items())
+    all_seconds = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', setup + CHILD.format(code=code)],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True).stdout
+        seconds, pyparsing, numpy = output.split()
+        all_seconds.append(float(seconds))
+    return median(all_seconds), pyparsing == 'True', numpy == 'True'
+
+
+def main(repeat=5):
+    with TemporaryDirectory() as folder:
+        ir_path = os.path.join(folder, 'rules.json')
+        with open(ir_path, 'w') as f:
+            dump_rules({str(i): ASI2(rule)
+                        for i, rule in enumerate(read_rules())}, f)
+        for name, code in SCENARIOS.items():
+            seconds, pyparsing, numpy = time_scenario(code,
+                                                      repeat,
+                                                      ir_path=ir_path,
+                                                      rules_path=RULES_PATH)
+            imported = [module
+                        for module, was_imported in (('pyparsing', pyparsing),
+                                                     ('numpy', numpy))
+                        if was_imported]
+            print('{}: {:.1f} ms, imported {}'.format(
+                name,
+                seconds * 1000,
+                ', '.join(imported) or 'no dependencies'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Compare rule evaluation with and without residue tracking
+"""
+import random
+from timeit import timeit
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.hcvr import HCVR
+
+from benchmarks import read_rules, synthetic_calls, synthetic_reference
+
+
+def measure(parser_class, samples, repeat=5):
+    """Measure samples per second through the whole rule bank"""
+    rules = [parser_class(rule) for rule in read_rules()]
+    results = {}
+    for residues in (True, False):
+        seconds = timeit(lambda: [rule(sample, residues=residues)
+                                  for sample in samples
+                                  for rule in rules],
+                         number=repeat)
+        results[residues] = len(samples) * repeat / seconds
+    return results
+
+
+def main():
+    rng = random.Random(42)
+    reference = synthetic_reference(rng)
+    samples = [synthetic_calls(rng, reference) for _ in range(100)]
+    for parser_class in (ASI2, HCVR):
+        results = measure(parser_class, samples)
+        print('{}: {:.0f} samples/s with residues, {:.0f} samples/s without '
+              '({:.1f}x)'.format(parser_class.__name__,
+                                 results[True],
+                                 results[False],
+                                 results[False] / results[True]))
+
+
+if __name__ == '__main__':
+    main()
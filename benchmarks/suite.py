@@ -0,0 +1,140 @@
+"""
+Reproducible benchmarks for parsing rule banks and scoring samples
+"""
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from statistics import median
+
+from pyvdrm import asi2, hcvr
+
+from benchmarks import read_rules, synthetic_calls, synthetic_reference
+
+PARSERS = {'ASI2': (asi2.ASI2, asi2), 'HCVR': (hcvr.HCVR, hcvr)}
+
+# how each evaluation mode scores a sample against one rule
+MODES = {
+    'tree': lambda rule: rule,
+    'compiled': lambda rule: rule.compile(),
+    'score_only': lambda rule: rule.compile(residues=False),
+    'short_circuit': lambda rule: rule.compile(residues=False,
+                                               short_circuit=True)}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def time_parse(parser_name, rules, repeat):
+    """Time building the grammar and parsing the whole rule bank"""
+    parser_class, module = PARSERS[parser_name]
+    start = time.perf_counter()
+    module._build_grammar()
+    grammar_seconds = time.perf_counter() - start
+
+    bank_seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for rule in rules:
+            parser_class(rule)
+        bank_seconds.append(time.perf_counter() - start)
+    return dict(benchmark='parse',
+                parser=parser_name,
+                rules=len(rules),
+                repeat=repeat,
+                grammar_seconds=grammar_seconds,
+                bank_seconds_min=min(bank_seconds),
+                bank_seconds_median=median(bank_seconds),
+                rule_seconds_median=median(bank_seconds) / len(rules))
+
+
+def time_latency(parser_name, mode, evaluators, samples, length, density):
+    """Time scoring each sample against the whole rule bank"""
+    latencies = []
+    for sample in samples:
+        start = time.perf_counter()
+        for evaluate in evaluators:
+            evaluate(sample)
+        latencies.append(time.perf_counter() - start)
+    return dict(benchmark='latency',
+                parser=parser_name,
+                mode=mode,
+                length=length,
+                density=density,
+                samples=len(samples),
+                seconds_median=median(latencies),
+                seconds_p90=percentile(latencies, 0.9),
+                seconds_p99=percentile(latencies, 0.99))
+
+
+def time_throughput(parser_name, mode, evaluators, samples, length, density):
+    """Time scoring a whole cohort against the whole rule bank"""
+    start = time.perf_counter()
+    for sample in samples:
+        for evaluate in evaluators:
+            evaluate(sample)
+    seconds = time.perf_counter() - start
+    return dict(benchmark='throughput',
+                parser=parser_name,
+                mode=mode,
+                length=length,
+                density=density,
+                samples=len(samples),
+                seconds=seconds,
+                samples_per_second=len(samples) / seconds)
+
+
+def run_suite(seed=42,
+              lengths=(400, 1000, 3000),
+              densities=(0.0, 0.01, 0.05),
+              cohort_size=200,
+              parse_repeat=3,
+              parsers=('ASI2', 'HCVR'),
+              modes=tuple(MODES)):
+    """ Run every benchmark and collect the results.
+
+    :param int seed: seeds the synthetic references and samples
+    :param lengths: reference lengths to generate samples for
+    :param densities: fraction of positions with a random variant
+    :param int cohort_size: samples for each length and density
+    :param int parse_repeat: times to parse the whole rule bank
+    :param parsers: names of the rule parsers to benchmark
+    :param modes: names of the evaluation modes to benchmark
+    :return: a dictionary that can be written as JSON
+    """
+    rules = read_rules()
+    results = []
+    for parser_name in parsers:
+        results.append(time_parse(parser_name, rules, parse_repeat))
+        parser_class, _ = PARSERS[parser_name]
+        parsed_rules = [parser_class(rule) for rule in rules]
+        for mode in modes:
+            evaluators = [MODES[mode](rule) for rule in parsed_rules]
+            for length in lengths:
+                for density in densities:
+                    rng = random.Random('{}-{}-{}'.format(seed,
+                                                          length,
+                                                          density))
+                    reference = synthetic_reference(rng, length)
+                    samples = [synthetic_calls(rng, reference, density)
+                               for _ in range(cohort_size)]
+                    results.append(time_latency(parser_name,
+                                                mode,
+                                                evaluators,
+                                                samples,
+                                                length,
+                                                density))
+                    results.append(time_throughput(parser_name,
+                                                   mode,
+                                                   evaluators,
+                                                   samples,
+                                                   length,
+                                                   density))
+    return dict(created=datetime.now(timezone.utc).isoformat(),
+                python=sys.version.split()[0],
+                platform=platform.platform(),
+                seed=seed,
+                results=results)
@@ -2,37 +2,63 @@
 ASI2 Parser definition
 """
 
+from bisect import bisect_right
 from functools import reduce, total_ordering
-from pyparsing import (Literal, nums, Word, Forward, Optional, Regex,
-                       infixNotation, delimitedList, opAssoc, ParseException)
 from pyvdrm.drm import AsiExpr, AsiBinaryExpr, DRMParser, MissingPositionError
-from pyvdrm.vcf import MutationSet
+from pyvdrm.drm import operand_span, spanned
+from pyvdrm.vcf import intern_mutation_set
+
+
+NO_RESIDUES = frozenset()
+
+
+def union_residues(residues1, residues2):
+    """Combine two sets of residues, sharing one if the other is empty"""
+    if not residues2:
+        return residues1
+    if not residues1:
+        return residues2
+    return residues1 | residues2
 
 
 @total_ordering
 class Score(object):
-    """Encapsulate a score and the residues that support it"""
+    """Encapsulate a score and the residues that support it
+
+    Scores are immutable, so they share their residues instead of copying
+    them. Use TRUE, FALSE, and ZERO for scores without residues.
+    """
 
-    residues = set([])
-    score = None
+    __slots__ = ('score', 'residues')
 
     def __init__(self, score, residues):
         """ Initialize.
 
         :param bool|float score: value of the score
-        :param residues: sequence of Mutations
+        :param residues: sequence of Mutations, which is shared if it is
+            already a frozenset
         """
-        self.score = score
-        self.residues = set(residues)
+        if not isinstance(residues, frozenset):
+            residues = frozenset(residues)
+        object.__setattr__(self, 'score', score)
+        object.__setattr__(self, 'residues', residues)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("can't set attribute")
+
+    def __reduce__(self):
+        return Score, (self.score, self.residues)
 
     def __add__(self, other):
-        return Score(self.score + other.score, self.residues | other.residues)
+        return Score(self.score + other.score,
+                     union_residues(self.residues, other.residues))
 
     def __sub__(self, other):
-        return Score(self.score - other.score, self.residues | other.residues)
+        return Score(self.score - other.score,
+                     union_residues(self.residues, other.residues))
 
     def __repr__(self):
-        return "Score({!r}, {!r})".format(self.score, self.residues)
+        return "Score({!r}, {!r})".format(self.score, set(self.residues))
 
     def __eq__(self, other):
         return self.score == other.score
@@ -47,36 +73,116 @@ class Score(object):
         return self.score
 
 
+TRUE = Score(True, NO_RESIDUES)
+FALSE = Score(False, NO_RESIDUES)
+ZERO = Score(0, NO_RESIDUES)
+
+
 class Negate(AsiExpr):
     """Unary negation of boolean child"""
     def __call__(self, mutations):
         child_score = self.children[0](mutations)
         if child_score is None:
-            return Score(True, [])  # TODO: propagate negative residues
+            return TRUE  # TODO: propagate negative residues
+        if not child_score.residues:
+            return FALSE if child_score.score else TRUE
         return Score(not child_score.score, child_score.residues)
 
+    def compile(self, compiler):
+        child = compiler(self.children[0])
+
+        if compiler.thresholds is not None:
+            all_thresholds = compiler.all_thresholds
+            return lambda mutations: all_thresholds ^ child(mutations)
+
+        if not compiler.residues:
+            return lambda mutations: not child(mutations)
+
+        def negate(mutations):
+            child_score = child(mutations)
+            if child_score is None:
+                return TRUE
+            if not child_score.residues:
+                return FALSE if child_score.score else TRUE
+            return Score(not child_score.score, child_score.residues)
+        return negate
+
 
 class AndExpr(AsiExpr):
     """Fold boolean AND on children"""
 
+    def __init__(self, label, pos, tokens):
+        super().__init__(label, pos, tokens)
+        self.span = operand_span(label, self.children[0])
+
     def __call__(self, mutations):
         scores = map(lambda f: f(mutations), self.children[0])
-        scores = [Score(False, []) if s is None else s for s in scores]
+        scores = [FALSE if s is None else s for s in scores]
         if not scores:
             raise ValueError
 
-        residues = set([])
+        residues = NO_RESIDUES
         for s in scores:
             if not s.score:
-                return Score(False, [])
-            residues = residues | s.residues
+                return FALSE
+            residues = union_residues(residues, s.residues)
 
+        if not residues:
+            return TRUE
         return Score(True, residues)
 
+    def compile(self, compiler):
+        children = [compiler(f) for f in self.children[0]]
+        if not children:
+            raise ValueError
+
+        if compiler.thresholds is not None:
+            all_thresholds = compiler.all_thresholds
+
+            def and_thresholds(mutations):
+                # every child is evaluated, so missing positions are found
+                bits = all_thresholds
+                for f in children:
+                    bits &= f(mutations)
+                return bits
+            return and_thresholds
+
+        if compiler.short_circuit:
+            def and_short_circuit(mutations):
+                for f in children:
+                    if not f(mutations):
+                        return False
+                return True
+            return and_short_circuit
+
+        if not compiler.residues:
+            def and_score(mutations):
+                # every child is evaluated, so missing positions are found
+                scores = [f(mutations) for f in children]
+                return all(scores)
+            return and_score
+
+        def and_expr(mutations):
+            # every child is evaluated, so missing positions are still found
+            scores = [f(mutations) for f in children]
+            residues = NO_RESIDUES
+            for s in scores:
+                if s is None or not s.score:
+                    return FALSE
+                residues = union_residues(residues, s.residues)
+            if not residues:
+                return TRUE
+            return Score(True, residues)
+        return and_expr
+
 
 class OrExpr(AsiBinaryExpr):
     """Boolean OR on children (binary only)"""
 
+    def __init__(self, label, pos, tokens):
+        super().__init__(label, pos, tokens)
+        self.span = operand_span(label, self.children)
+
     def __call__(self, mutations):
         arg1, arg2 = self.children
 
@@ -84,12 +190,57 @@ class OrExpr(AsiBinaryExpr):
         score2 = arg2(mutations)
 
         if score1 is None:
-            score1 = Score(False, [])
+            score1 = FALSE
         if score2 is None:
-            score2 = Score(False, [])
-
-        return Score(score1.score or score2.score,
-                     score1.residues | score2.residues)
+            score2 = FALSE
+
+        score = score1.score or score2.score
+        residues = union_residues(score1.residues, score2.residues)
+        if score is False and not residues:
+            return FALSE
+        return Score(score, residues)
+
+    def compile(self, compiler):
+        arg1, arg2 = (compiler(f) for f in self.children)
+
+        if compiler.thresholds is not None:
+            return lambda mutations: arg1(mutations) | arg2(mutations)
+
+        if compiler.short_circuit:
+            def or_short_circuit(mutations):
+                score1 = arg1(mutations)
+                if score1:
+                    return score1
+                score2 = arg2(mutations)
+                if score2 is None:
+                    return False
+                return score2
+            return or_short_circuit
+
+        if not compiler.residues:
+            def or_score(mutations):
+                score1 = arg1(mutations)
+                score2 = arg2(mutations)
+                if score1 is None:
+                    score1 = False
+                if score2 is None:
+                    score2 = False
+                return score1 or score2
+            return or_score
+
+        def or_expr(mutations):
+            score1 = arg1(mutations)
+            score2 = arg2(mutations)
+            if score1 is None:
+                score1 = FALSE
+            if score2 is None:
+                score2 = FALSE
+            score = score1.score or score2.score
+            residues = union_residues(score1.residues, score2.residues)
+            if score is False and not residues:
+                return FALSE
+            return Score(score, residues)
+        return or_expr
 
 
 class EqualityExpr(AsiExpr):
@@ -105,54 +256,188 @@ class EqualityExpr(AsiExpr):
             return x >= self.limit
         elif self.operation == 'EXACTLY':
             return x == self.limit
-        elif self.operation == 'NOMORETHAN':
+        elif self.operation == 'NOTMORETHAN':
             return x <= self.limit
 
         raise NotImplementedError
 
+    def decide(self, low, high):
+        """Evaluate for a count that is known to be between low and high,
+            or return None if the count could go either way
+        """
+        if self.operation == 'ATLEAST':
+            if low >= self.limit:
+                return True
+            if high < self.limit:
+                return False
+        elif self.operation == 'EXACTLY':
+            if low > self.limit or high < self.limit:
+                return False
+        elif self.operation == 'NOTMORETHAN':
+            if high <= self.limit:
+                return True
+            if low > self.limit:
+                return False
+        return None
+
+    def compile(self, compiler):
+        limit = self.limit
+        if self.operation == 'ATLEAST':
+            compare = lambda x: x >= limit
+        elif self.operation == 'EXACTLY':
+            compare = lambda x: x == limit
+        elif self.operation == 'NOTMORETHAN':
+            compare = lambda x: x <= limit
+        else:
+            def compare(x):
+                raise NotImplementedError
+
+        if compiler.thresholds is None:
+            return compare
+
+        def compare_thresholds(counts):
+            """Compare the count at each threshold"""
+            bits = 0
+            for i, count in enumerate(counts):
+                if compare(count):
+                    bits |= 1 << i
+            return bits
+        return compare_thresholds
+
 
 class ScoreExpr(AsiExpr):
     """Score expressions propagate DRM scores"""
 
-    def __call__(self, mutations):
-        if len(self.children) == 3:
-            operation, minus, score = self.children
+    def __init__(self, label, pos, children):
+        super().__init__(label, pos, children)
+        if len(children) == 3:
+            operation, minus, score = children
             if minus != '-':
                 raise ValueError
             score = -1 * int(score)
-        elif len(self.children) == 2:
-            operation, score = self.children
+        elif len(children) == 2:
+            operation, score = children
             score = int(score)
         else:
             raise ValueError
+        self.operation = operation
+        self.score = score
 
+    def __call__(self, mutations):
         # evaluate operation and return score
-        result = operation(mutations)
+        result = self.operation(mutations)
         if result is None:
             return None
 
         if result.score is False:
-            return Score(0, [])
-        return Score(score, result.residues)
+            return ZERO
+        return Score(self.score, result.residues)
+
+    def compile(self, compiler):
+        operation = compiler(self.operation)
+        score = self.score
+
+        if compiler.thresholds is not None:
+            all_thresholds = compiler.all_thresholds
+            count = len(compiler.thresholds)
+            all_scores = [score] * count
+            no_scores = [0] * count
+
+            def score_expr_thresholds(mutations):
+                bits = operation(mutations)
+                if bits == all_thresholds:
+                    return all_scores
+                if not bits:
+                    return no_scores
+                return [score if bits >> i & 1 else 0 for i in range(count)]
+            return score_expr_thresholds
+
+        if not compiler.residues:
+            def score_expr_score(mutations):
+                result = operation(mutations)
+                if result is None:
+                    return None
+                if result is False:
+                    return 0
+                return score
+            return score_expr_score
+
+        def score_expr(mutations):
+            result = operation(mutations)
+            if result is None:
+                return None
+            if result.score is False:
+                return ZERO
+            return Score(score, result.residues)
+        return score_expr
 
 
 class ScoreList(AsiExpr):
     """Lists of scores are either summed or maxed"""
 
-    def __call__(self, mutations):
-        operation, *rest = self.children
+    def __init__(self, label, pos, children):
+        super().__init__(label, pos, children)
+        operation, *rest = children
         if operation == 'MAX':
-            terms = rest
-            func = max
+            self.terms = rest
+            self.func = max
         else:
             # the default operation is sum
-            terms = self.children
-            func = sum
-        scores = [f(mutations) for f in terms]
+            self.terms = list(children)
+            self.func = sum
+
+    def __call__(self, mutations):
+        scores = [f(mutations) for f in self.terms]
         matched_scores = [score.score for score in scores if score.score]
-        residues = reduce(lambda x, y: x | y,
+        residues = reduce(union_residues,
                           (score.residues for score in scores))
-        return Score(bool(matched_scores) and func(matched_scores), residues)
+        score = bool(matched_scores) and self.func(matched_scores)
+        if score is False and not residues:
+            return FALSE
+        return Score(score, residues)
+
+    def bounds(self):
+        """The lowest and highest total this list can produce"""
+        scores = [term.score for term in self.terms]
+        if self.func is sum:
+            return (sum(score for score in scores if score < 0),
+                    sum(score for score in scores if score > 0))
+        return min(0, *scores), max(0, *scores)
+
+    def compile(self, compiler):
+        terms = [compiler(f) for f in self.terms]
+        func = self.func
+
+        if compiler.thresholds is not None:
+            def score_list_thresholds(mutations):
+                scores = [f(mutations) for f in terms]
+                totals = []
+                for threshold_scores in zip(*scores):
+                    matched_scores = [score
+                                      for score in threshold_scores
+                                      if score]
+                    totals.append(bool(matched_scores) and
+                                  func(matched_scores))
+                return totals
+            return score_list_thresholds
+
+        if not compiler.residues:
+            def score_list_score(mutations):
+                scores = [f(mutations) for f in terms]
+                matched_scores = [score for score in scores if score]
+                return bool(matched_scores) and func(matched_scores)
+            return score_list_score
+
+        def score_list(mutations):
+            scores = [f(mutations) for f in terms]
+            matched_scores = [score.score for score in scores if score.score]
+            residues = reduce(union_residues,
+                              (score.residues for score in scores))
+            score = bool(matched_scores) and func(matched_scores)
+            if score is False and not residues:
+                return FALSE
+            return Score(score, residues)
+        return score_list
 
 
 class SelectFrom(AsiExpr):
@@ -163,16 +448,63 @@ class SelectFrom(AsiExpr):
         #     raise TypeError()
         pass
 
-    def __call__(self, mutations):
-        operation, *rest = self.children
+    def __init__(self, label, pos, children):
+        super().__init__(label, pos, children)
         # the head of the arg list must be an equality expression
+        self.operation, *self.terms = children
 
-        scored = [f(mutations) for f in rest]
+    def __call__(self, mutations):
+        scored = [f(mutations) for f in self.terms]
         passing = sum(bool(score.score) for score in scored)
 
-        return Score(operation(passing),
-                     reduce(lambda x, y: x | y,
-                            (item.residues for item in scored)))
+        residues = reduce(union_residues, (item.residues for item in scored))
+        if not residues:
+            return TRUE if self.operation(passing) else FALSE
+        return Score(self.operation(passing), residues)
+
+    def compile(self, compiler):
+        operation = compiler(self.operation)
+        terms = [compiler(f) for f in self.terms]
+
+        if compiler.thresholds is not None:
+            count = len(compiler.thresholds)
+
+            def select_from_thresholds(mutations):
+                scored = [f(mutations) for f in terms]
+                return operation([sum(bits >> i & 1 for bits in scored)
+                                  for i in range(count)])
+            return select_from_thresholds
+
+        decide = getattr(self.operation, 'decide', None)
+        if compiler.short_circuit and decide is not None:
+            def select_from_short_circuit(mutations):
+                passing = 0
+                remaining = len(terms)
+                for f in terms:
+                    result = decide(passing, passing + remaining)
+                    if result is not None:
+                        return result
+                    remaining -= 1
+                    if f(mutations):
+                        passing += 1
+                return operation(passing)
+            return select_from_short_circuit
+
+        if not compiler.residues:
+            def select_from_score(mutations):
+                scored = [f(mutations) for f in terms]
+                return operation(sum(bool(score) for score in scored))
+            return select_from_score
+
+        def select_from(mutations):
+            scored = [f(mutations) for f in terms]
+            passing = sum(bool(score.score) for score in scored)
+            residues = reduce(union_residues,
+                              (item.residues for item in scored))
+            if not residues:
+                return TRUE if operation(passing) else FALSE
+            return Score(operation(passing), residues)
+        return select_from
 
 
 class AsiScoreCond(AsiExpr):
@@ -182,7 +514,38 @@ class AsiScoreCond(AsiExpr):
 
     def __call__(self, args):
         """Score conditions evaluate a list of expressions and sum scores"""
-        return sum((f(args) for f in self.children), Score(False, set()))
+        scores = [f(args) for f in self.children]
+        # add up the scores once, instead of a new Score per term
+        return Score(sum((s.score for s in scores), False),
+                     reduce(union_residues,
+                            (s.residues for s in scores),
+                            NO_RESIDUES))
+
+    def compile(self, compiler):
+        terms = [compiler(f) for f in self.children]
+
+        if compiler.thresholds is not None:
+            def score_cond_thresholds(mutations):
+                scores = [f(mutations) for f in terms]
+                return [sum(threshold_scores, False)
+                        for threshold_scores in zip(*scores)]
+            return score_cond_thresholds
+
+        if not compiler.residues:
+            return lambda mutations: sum((f(mutations) for f in terms), False)
+
+        def score_cond(mutations):
+            scores = [f(mutations) for f in terms]
+            # add up the scores once, instead of a new Score per term
+            return Score(sum((s.score for s in scores), False),
+                         reduce(union_residues,
+                                (s.residues for s in scores),
+                                NO_RESIDUES))
+        return score_cond
+
+    def bounded_terms(self, compiler):
+        """Compile each score list, along with its lowest and highest total"""
+        return [(compiler(f),) + f.bounds() for f in self.children]
 
 
 class AsiMutations(object):
@@ -191,97 +554,202 @@ class AsiMutations(object):
     def __init__(self, _label=None, _pos=None, args=None):
         """Initialize set of mutations from a potentially ambiguous residue
         """
-        self.mutations = MutationSet(''.join(args))
+        self.mutations = intern_mutation_set(''.join(args))
 
     def __repr__(self):
         return "AsiMutations(args={!r})".format(str(self.mutations))
 
+    def referenced_positions(self):
+        return {self.mutations.pos}
+
+    def structure_key(self):
+        mutations = self.mutations
+        return type(self), mutations.pos, mutations.wildtype, mutations.mask
+
     def __call__(self, env):
-        is_found = False
-        for mutation_set in env:
-            is_found |= mutation_set.pos == self.mutations.pos
-            intersection = self.mutations.mutations & mutation_set.mutations
-            if len(intersection) > 0:
-                return Score(True, intersection)
-
-        if not is_found:
+        try:
+            positions = env.positions
+        except AttributeError:
+            # plain sequences of MutationSets have no position index
+            positions = {mutation_set.pos: mutation_set
+                         for mutation_set in env}
+        mutation_set = positions.get(self.mutations.pos)
+        if mutation_set is None:
             # Some required positions were not found in the environment.
             raise MissingPositionError('Missing position {}.'.format(
                 self.mutations.pos))
-        return Score(False, set())
-
 
-class ASI2(DRMParser):
-    """ASI2 Syntax definition"""
-
-    def parser(self, rule):
+        if self.mutations.mask & mutation_set.mask:
+            return Score(True, mutation_set.intersection(self.mutations))
+        return FALSE
+
+    def compile(self, compiler):
+        pattern = self.mutations
+        pos = pattern.pos
+        mask = pattern.mask
+        wildtype = pattern.wildtype
+
+        if compiler.thresholds is not None:
+            thresholds = compiler.thresholds
+
+            def asi_mutations_thresholds(env):
+                try:
+                    positions = env.positions
+                except AttributeError:
+                    positions = {mutation_set.pos: mutation_set
+                                 for mutation_set in env}
+                mutation_set = positions.get(pos)
+                if mutation_set is None:
+                    raise MissingPositionError(
+                        'Missing position {}.'.format(pos))
+                frequency = mutation_set.max_frequency(mask)
+                if frequency is None:
+                    return 0
+                if (wildtype is not None and
+                        mutation_set.wildtype is not None and
+                        mutation_set.wildtype != wildtype):
+                    raise ValueError('Wild type mismatch between {} and {}.'
+                                     .format(mutation_set, pattern))
+                # present at every threshold up to its frequency
+                return (1 << bisect_right(thresholds, frequency)) - 1
+            return asi_mutations_thresholds
+
+        if not compiler.residues:
+            def asi_mutations_score(env):
+                try:
+                    positions = env.positions
+                except AttributeError:
+                    positions = {mutation_set.pos: mutation_set
+                                 for mutation_set in env}
+                mutation_set = positions.get(pos)
+                if mutation_set is None:
+                    raise MissingPositionError(
+                        'Missing position {}.'.format(pos))
+                if not mask & mutation_set.mask:
+                    return False
+                if (wildtype is not None and
+                        mutation_set.wildtype is not None and
+                        mutation_set.wildtype != wildtype):
+                    raise ValueError('Wild type mismatch between {} and {}.'
+                                     .format(mutation_set, pattern))
+                return True
+            return asi_mutations_score
+
+        def asi_mutations(env):
+            try:
+                positions = env.positions
+            except AttributeError:
+                positions = {mutation_set.pos: mutation_set
+                             for mutation_set in env}
+            mutation_set = positions.get(pos)
+            if mutation_set is None:
+                raise MissingPositionError(
+                    'Missing position {}.'.format(pos))
+
+            if mask & mutation_set.mask:
+                return Score(True, mutation_set.intersection(pattern))
+            return FALSE
+        return asi_mutations
+
+
+_grammar = None
+
+
+def grammar():
+    """Build the ASI2 grammar on first use, and reuse it for every rule"""
+    global _grammar
+    if _grammar is None:
+        _grammar = _build_grammar()
+    return _grammar
+
+
+def _build_grammar():
+    """Define the ASI2 syntax, with parse actions that build the tree"""
+    # pyparsing is only imported when a rule string needs to be parsed
+    from pyparsing import (Literal, nums, Word, Forward, Optional, Regex,
+                           infixNotation, delimitedList, opAssoc)
+
+    select = Literal('SELECT').suppress()
+    except_ = Literal('EXCEPT')
+    exactly = Literal('EXACTLY')
+    atleast = Literal('ATLEAST')
+
+    from_ = Literal('FROM').suppress()
+
+    max_ = Literal('MAX')
+
+    and_ = Literal('AND').suppress()
+    or_ = Literal('OR').suppress()
+    # min_ = Literal('MIN')
+
+    notmorethan = Literal('NOTMORETHAN')
+    l_par = Literal('(').suppress()
+    r_par = Literal(')').suppress()
+    mapper = Literal('=>').suppress()
+    integer = Word(nums)
+
+    mutation = Optional(Regex(r'[A-Z]')) + integer + Regex(r'[diA-Z]+')
+    mutation.setParseAction(AsiMutations)
+    mutation = spanned(mutation)
+
+    not_ = Literal('NOT').suppress() + mutation
+    not_.setParseAction(Negate)
+    not_ = spanned(not_)
+
+    residue = mutation | not_
+    # integer + l_par + not_ + Regex(r'[A-Z]+') + r_par
+    # roll this next rule into the mutation object
+
+    # Syntax of ASI expressions
+    excludestatement = except_ + residue
+
+    quantifier = exactly | atleast | notmorethan
+    inequality = quantifier + integer
+    inequality.setParseAction(EqualityExpr)
+    inequality = spanned(inequality)
+
+    select_quantifier = infixNotation(inequality,
+                                      [(and_, 2, opAssoc.LEFT, AndExpr),
+                                       (or_, 2, opAssoc.LEFT, OrExpr)])
+
+    residue_list = l_par + delimitedList(residue) + r_par
+
+    # so selectstatement.eval :: [Mutation] -> Maybe Bool
+    selectstatement = select + select_quantifier + from_ + residue_list
+    selectstatement.setParseAction(SelectFrom)
+    selectstatement = spanned(selectstatement)
+
+    booleancondition = Forward()
+    condition = residue | excludestatement | selectstatement
+
+    booleancondition << infixNotation(condition,
+                                      [(and_, 2, opAssoc.LEFT, AndExpr),
+                                       (or_, 2, opAssoc.LEFT, OrExpr)]) | condition
 
-        select = Literal('SELECT').suppress()
-        except_ = Literal('EXCEPT')
-        exactly = Literal('EXACTLY')
-        atleast = Literal('ATLEAST')
+    scoreitem = booleancondition + mapper + Optional(Literal('-')) + integer
+    scoreitem.setParseAction(ScoreExpr)
+    scoreitem = spanned(scoreitem)
+    scorelist = max_ + l_par + delimitedList(scoreitem) + r_par |\
+        delimitedList(scoreitem)
+    scorelist.setParseAction(ScoreList)
+    scorelist = spanned(scorelist)
 
-        from_ = Literal('FROM').suppress()
+    scorecondition = Literal('SCORE FROM').suppress() +\
+        l_par + delimitedList(scorelist) + r_par
 
-        max_ = Literal('MAX')
+    scorecondition.setParseAction(AsiScoreCond)
+    scorecondition = spanned(scorecondition)
 
-        and_ = Literal('AND').suppress()
-        or_ = Literal('OR').suppress()
-        # min_ = Literal('MIN')
+    statement = booleancondition | scorecondition
+    return statement
 
-        notmorethan = Literal('NOTMORETHAN')
-        l_par = Literal('(').suppress()
-        r_par = Literal(')').suppress()
-        mapper = Literal('=>').suppress()
-        integer = Word(nums)
 
-        mutation = Optional(Regex(r'[A-Z]')) + integer + Regex(r'[diA-Z]+')
-        mutation.setParseAction(AsiMutations)
-
-        not_ = Literal('NOT').suppress() + mutation
-        not_.setParseAction(Negate)
-
-        residue = mutation | not_
-        # integer + l_par + not_ + Regex(r'[A-Z]+') + r_par
-        # roll this next rule into the mutation object
-
-        # Syntax of ASI expressions
-        excludestatement = except_ + residue
-
-        quantifier = exactly | atleast | notmorethan
-        inequality = quantifier + integer
-        inequality.setParseAction(EqualityExpr)
-
-        select_quantifier = infixNotation(inequality,
-                                          [(and_, 2, opAssoc.LEFT, AndExpr),
-                                           (or_, 2, opAssoc.LEFT, OrExpr)])
-
-        residue_list = l_par + delimitedList(residue) + r_par
-
-        # so selectstatement.eval :: [Mutation] -> Maybe Bool
-        selectstatement = select + select_quantifier + from_ + residue_list
-        selectstatement.setParseAction(SelectFrom)
-
-        booleancondition = Forward()
-        condition = residue | excludestatement | selectstatement
-
-        booleancondition << infixNotation(condition,
-                                          [(and_, 2, opAssoc.LEFT, AndExpr),
-                                           (or_, 2, opAssoc.LEFT, OrExpr)]) | condition
-
-        scoreitem = booleancondition + mapper + Optional(Literal('-')) + integer
-        scoreitem.setParseAction(ScoreExpr)
-        scorelist = max_ + l_par + delimitedList(scoreitem) + r_par |\
-            delimitedList(scoreitem)
-        scorelist.setParseAction(ScoreList)
-
-        scorecondition = Literal('SCORE FROM').suppress() +\
-            l_par + delimitedList(scorelist) + r_par
-
-        scorecondition.setParseAction(AsiScoreCond)
-
-        statement = booleancondition | scorecondition
+class ASI2(DRMParser):
+    """ASI2 Syntax definition"""
 
+    def parser(self, rule):
+        statement = grammar()
+        from pyparsing import ParseException
         try:
             return statement.parseString(rule)
         except ParseException as ex:
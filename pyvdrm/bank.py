@@ -0,0 +1,119 @@
+"""
+Evaluate a panel of rules, sharing the expressions they have in common
+"""
+from collections import namedtuple
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.drm import CompiledRule
+from pyvdrm.hcvr import HCVR
+from pyvdrm.incremental import Evaluation, MemoizingCompiler
+
+BankInfo = namedtuple('BankInfo', 'rules nodes shared_nodes')
+
+# rule syntaxes that can be chosen by name, like on the command line
+PARSERS = {'asi2': ASI2, 'hcvr': HCVR}
+
+
+def read_rules(lines):
+    """ Read rule texts, one per line.
+
+    A line can start with a name and a tab, otherwise the rule is named by
+    its line number. Blank lines and lines that start with # are skipped.
+    :param lines: an open file, or any other iterable of lines
+    :return: a dictionary from names to rule texts, in file order
+    """
+    rules = {}
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip() or line.startswith('#'):
+            continue
+        name, tab, rule = line.rstrip('\r\n').partition('\t')
+        if not tab:
+            name, rule = str(line_number), name
+        rules[name] = rule
+    return rules
+
+
+class SharingCompiler(MemoizingCompiler):
+    """Compiles identical expressions into a single memoized closure
+
+    Expressions are identical when their structure_key() matches, so the same
+    residue or condition in many rules is only evaluated once per sample.
+    """
+
+    def __init__(self, residues=True):
+        super().__init__(residues)
+        self.shared = {}  # {structure key: closure}
+        self.sizes = {}  # {structure key: nodes in the expression}
+        self.node_count = 0  # nodes in all the expressions compiled
+
+    def __call__(self, node):
+        key = node.structure_key()
+        evaluate = self.shared.get(key)
+        if evaluate is not None:
+            self.node_count += self.sizes[key]
+            return evaluate
+        start_count = self.node_count
+        evaluate = self.shared[key] = super().__call__(node)
+        self.node_count += 1
+        self.sizes[key] = self.node_count - start_count
+        return evaluate
+
+
+class RuleBank(object):
+    """A panel of rules that evaluates each distinct expression once per
+        sample
+    """
+
+    def __init__(self, rules=None, residues=False):
+        """ Initialize.
+
+        :param rules: a mapping from names to parsed rules
+        :param bool residues: True to evaluate expressions with the residues
+            and flags that support them, which doesn't change the scores
+        """
+        self.residues = residues
+        self.rules = []  # [(name, compiled rule)]
+        self._compiler = SharingCompiler(residues)
+        if rules is not None:
+            for name, rule in rules.items():
+                self.add(name, rule)
+
+    def add(self, name, rule):
+        """Add a parsed rule to the bank, sharing the expressions that are
+            already in it
+        """
+        evaluate = self._compiler(rule.dtree)
+        self.rules.append((name, CompiledRule(rule.rule,
+                                              evaluate,
+                                              self.residues)))
+
+    def evaluate(self, mutations):
+        """Score a sample against every rule.
+
+        :param mutations: the VariantCalls to score
+        :return: an Evaluation with a score for each rule name
+        """
+        try:
+            positions = mutations.positions
+        except AttributeError:
+            positions = {mutation_set.pos: mutation_set
+                         for mutation_set in mutations}
+        evaluation = Evaluation(positions, {}, self._compiler.new_memo())
+        for name, rule in self.rules:
+            evaluation.scores[name] = rule(evaluation)
+        return evaluation
+
+    def __call__(self, mutations):
+        """Score a sample against every rule.
+
+        :return: a dictionary from each rule name to its score
+        """
+        return self.evaluate(mutations).scores
+
+    def info(self):
+        """Count the rules, the expressions in them, and the distinct
+            expressions that are evaluated
+        """
+        return BankInfo(len(self.rules),
+                        self._compiler.node_count,
+                        len(self._compiler.shared))
@@ -0,0 +1,115 @@
+"""
+Score a cohort of samples against a bank of rules in parallel
+"""
+import os
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.drm import MissingPositionError
+
+# rules compiled by each worker process's initializer, and how to score
+_worker_rules = None
+_worker_score = None
+
+
+def compile_rules(rules, parser_class=ASI2):
+    """ Parse and compile a bank of rules for score-only evaluation.
+
+    :param rules: a mapping from names to rule strings or parsed rules
+    :param parser_class: DRMParser subclass that parses the rule strings
+    :return: a list of (name, compiled rule) pairs in the mapping's order
+    """
+    return [(name, parse_rule(rule, parser_class).compile(residues=False))
+            for name, rule in rules.items()]
+
+
+def parse_rule(rule, parser_class=ASI2):
+    """Parse a rule string, or return a rule that was already parsed"""
+    if isinstance(rule, str):
+        return parser_class(rule)
+    return rule
+
+
+def score_sample(compiled_rules, sample):
+    """ Score one sample against a compiled bank of rules.
+
+    :param compiled_rules: (name, compiled rule) pairs from compile_rules()
+    :param sample: the VariantCalls to score
+    :return: a dictionary from each rule name to its score
+    """
+    return {name: rule(sample) for name, rule in compiled_rules}
+
+
+def _score_or_error(compiled_rules, sample):
+    try:
+        return score_sample(compiled_rules, sample)
+    except (MissingPositionError, ValueError) as ex:
+        return ex
+
+
+def _init_worker(rules, return_errors):
+    global _worker_rules, _worker_score
+    _worker_rules = compile_rules(rules)
+    _worker_score = _score_or_error if return_errors else score_sample
+
+
+def _score_worker_sample(sample):
+    return _worker_score(_worker_rules, sample)
+
+
+def evaluate_cohort(rules,
+                    samples,
+                    workers=None,
+                    parser_class=ASI2,
+                    chunksize=64,
+                    return_errors=False):
+    """ Score every sample against every rule, using a pool of processes.
+
+    The rules are parsed once in this process, and sent to the workers as
+    their IR, so each worker only has to compile them when it starts.
+    Samples are read and sent to the workers a batch at a time, so samples
+    can be a long generator, like the ones from read_fasta(), without
+    holding it all in memory.
+
+    :param rules: a mapping from names to rule strings or parsed rules
+    :param samples: an iterable of VariantCalls
+    :param int workers: the number of worker processes, or None for one per
+        CPU. Zero scores the samples in this process, without a pool.
+    :param parser_class: DRMParser subclass that parses the rules
+    :param int chunksize: the number of samples sent to a worker at once
+    :param bool return_errors: True to return the MissingPositionError or
+        ValueError from a sample that can't be scored, instead of raising it
+    :return: a generator of dictionaries from rule names to scores, one for
+        each sample in input order
+    """
+    rules = {name: parse_rule(rule, parser_class)
+             for name, rule in rules.items()}
+    if workers == 0:
+        compiled_rules = compile_rules(rules, parser_class)
+        score = _score_or_error if return_errors else score_sample
+        for sample in samples:
+            yield score(compiled_rules, sample)
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with Pool(workers,
+              initializer=_init_worker,
+              initargs=(rules, return_errors)) as pool:
+        # imap reads all of its input right away, so give it one batch at a
+        # time, and queue the next batch while this one is collected
+        batch_size = workers * chunksize * 4
+        samples = iter(samples)
+        pending = deque()
+        while True:
+            batch = list(islice(samples, batch_size))
+            if batch:
+                pending.append(pool.imap(_score_worker_sample,
+                                         batch,
+                                         chunksize))
+            if not pending:
+                break
+            if len(pending) > 1 or not batch:
+                yield from pending.popleft()
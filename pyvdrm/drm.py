@@ -2,6 +2,10 @@
 """
 
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_right
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import perf_counter
 
 
 class AsiParseError(Exception):
@@ -12,41 +16,505 @@ class MissingPositionError(Exception):
     pass
 
 
+def enable_packrat(cache_size_limit=128):
+    """Memoize intermediate parse results while parsing rule strings.
+
+    The rule grammars backtrack heavily through their infix notation, so
+    packrat parsing speeds up loading large rule banks. This is a global
+    pyparsing setting that affects every grammar in the process.
+
+    :param int cache_size_limit: maximum number of cached results, or None
+        for an unbounded cache
+    """
+    from pyparsing import ParserElement
+    ParserElement.enablePackrat(cache_size_limit)
+
+
+def normalize_rule(rule):
+    """Collapse runs of white space, so equivalent rule texts match"""
+    return ' '.join(rule.split())
+
+
+def spanned(expr):
+    """ Record where each node that expr builds was found in the rule text.
+
+    :param expr: grammar element with a parse action that builds a node
+    :return: a grammar element that sets the node's span attribute to its
+        (start, end) offsets
+    """
+    from pyparsing import Empty
+    start = Empty().setParseAction(lambda s, loc, tokens: loc)
+    end = Empty().leaveWhitespace().setParseAction(lambda s, loc, tokens: loc)
+    located = start + expr + end
+    located.setParseAction(_set_spans)
+    return located
+
+
+def _set_spans(tokens):
+    start, *nodes, end = tokens
+    for node in nodes:
+        node.span = (start, end)
+    return nodes
+
+
+def operand_span(text, operands):
+    """ Find the span of an infix expression from the spans of its operands.
+
+    The location that pyparsing passes to infix parse actions differs between
+    versions, so only the rule text and the operands' spans are used.
+    :param str text: the rule text
+    :param operands: nodes joined by the infix operator
+    :return: (start, end) offsets, or None if an end operand has no span
+    """
+    first = getattr(operands[0], 'span', None)
+    last = getattr(operands[-1], 'span', None)
+    if first is None or last is None:
+        return None
+    start = first[0]
+    end = last[1]
+    # include the parentheses around grouped first and last operands
+    open_count = close_count = 0
+    for c in text[start:end]:
+        if c == '(':
+            open_count += 1
+        elif c == ')':
+            if open_count:
+                open_count -= 1
+            else:
+                close_count += 1
+    for _ in range(close_count):
+        start = text.rindex('(', 0, start)
+    for _ in range(open_count):
+        end = text.index(')', end) + 1
+    return start, end
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+
+class RuleCache(object):
+    """Bounded, thread-safe cache of parsed rules, evicted by LRU"""
+
+    def __init__(self, maxsize=1024):
+        """ Initialize.
+
+        :param int maxsize: the most parsed rules to keep
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._parsers = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, parser_class, rule):
+        """Find a parsed rule, or parse it and add it to the cache.
+
+        :param parser_class: DRMParser subclass that parses the rule
+        :param str rule: rule text, normalized for the lookup
+        """
+        key = (parser_class, normalize_rule(rule))
+        with self._lock:
+            parser = self._parsers.get(key)
+            if parser is not None:
+                self._parsers.move_to_end(key)
+                self.hits += 1
+                return parser
+            self.misses += 1
+
+        # parse outside the lock, so other rules can still be looked up
+        parser = parser_class(rule)
+        with self._lock:
+            self._parsers[key] = parser
+            while len(self._parsers) > self.maxsize:
+                self._parsers.popitem(last=False)
+        return parser
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits,
+                             self.misses,
+                             self.maxsize,
+                             len(self._parsers))
+
+    def clear(self):
+        with self._lock:
+            self._parsers.clear()
+            self.hits = self.misses = 0
+
+
+rule_cache = RuleCache()
+
+
 class DRMParser(metaclass=ABCMeta):
     """abstract class for DRM rule parsers/evaluators"""
 
-    def __init__(self, rule):
+    def __init__(self, rule, dtree=None):
         """drug resistance mutation callers are initialized with rule strings,
             the initialized parser has a callable decision tree object
+
+        :param str rule: the rule text
+        :param dtree: the rule's decision tree, if it was already built, so
+            the rule text isn't parsed again
         """
         self.rule = rule
-        self.dtree, *rest = self.parser(rule)
+        if dtree is None:
+            dtree, *rest = self.parser(rule)
+        self.dtree = dtree
+        self.required_positions = frozenset(
+            self.dtree.referenced_positions())
+        self._bounded_terms = None
+        self._score_evaluators = {}
+
+    @classmethod
+    def from_cached(cls, rule):
+        """Parse a rule, or reuse an earlier parse of the same rule text.
+
+        Cached rules are shared between callers, so the rule attribute holds
+        the text of the first caller.
+        """
+        return rule_cache.get(cls, rule)
 
     @abstractmethod
     def parser(self, rule_string):
         """The parser returns a decision tree based on the rule string"""
         pass
 
-    def __call__(self, mutations):
+    def __call__(self, mutations, residues=True, short_circuit=False):
+        """Evaluate the rule.
+
+        :param mutations: the environment to evaluate
+        :param bool residues: False skips tracking the residues and flags
+            that support the score, which is faster when only the score is
+            needed
+        :param bool short_circuit: True stops evaluating AND, OR, and SELECT
+            expressions as soon as their result is known, so positions in the
+            skipped expressions aren't checked for coverage. Only allowed
+            without residues.
+        """
+        if not residues:
+            evaluate = self._score_evaluators.get(short_circuit)
+            if evaluate is None:
+                compiler = Compiler(residues=False,
+                                    short_circuit=short_circuit)
+                evaluate = compiler(self.dtree)
+                self._score_evaluators[short_circuit] = evaluate
+            score = evaluate(mutations)
+            if score is None:
+                return False
+            return score
+
+        if short_circuit:
+            raise ValueError('Short circuit evaluation needs residues=False.')
         score = self.dtree(mutations)
         if score is None:
             return False
         return score.score
 
+    def check_coverage(self, mutations):
+        """Check that a sample covers every position that the rule refers to,
+            before spending any time evaluating it
+
+        :param mutations: the environment to evaluate
+        :raises MissingPositionError: if any positions are missing
+        """
+        try:
+            positions = mutations.positions
+        except AttributeError:
+            positions = {mutation_set.pos for mutation_set in mutations}
+        missing = sorted(pos
+                         for pos in self.required_positions
+                         if pos not in positions)
+        if len(missing) == 1:
+            raise MissingPositionError('Missing position {}.'.format(
+                missing[0]))
+        if missing:
+            raise MissingPositionError('Missing positions {}.'.format(
+                ', '.join(map(str, missing))))
+
+    def level(self, mutations, cutoffs):
+        """Find which level a SCORE FROM rule's total falls into.
+
+        Score lists are evaluated from the widest range of possible scores to
+        the narrowest, and evaluation stops as soon as the remaining lists
+        can't move the total into another level. Expressions within each list
+        are short circuited. Positions in anything that is skipped are not
+        checked for coverage.
+
+        :param mutations: the environment to evaluate
+        :param cutoffs: ascending scores that start each level above zero
+        :return: (level, score) where level is the number of cutoffs at or
+            below the total, and score is the total of the evaluated lists
+        """
+        terms = self._bounded_terms
+        if terms is None:
+            try:
+                bounded_terms = self.dtree.bounded_terms
+            except AttributeError:
+                raise TypeError('Levels need a score condition, not {!r}.'
+                                .format(self.rule)) from None
+            compiler = Compiler(residues=False, short_circuit=True)
+            terms = sorted(bounded_terms(compiler),
+                           key=lambda term: term[1] - term[2])
+            self._bounded_terms = terms
+
+        score = 0
+        low = sum(term[1] for term in terms)
+        high = sum(term[2] for term in terms)
+        for evaluate, term_low, term_high in terms:
+            level = bisect_right(cutoffs, score + low)
+            if level == bisect_right(cutoffs, score + high):
+                return level, score
+            score += evaluate(mutations)
+            low -= term_low
+            high -= term_high
+        return bisect_right(cutoffs, score), score
+
+    def compile(self, residues=True, short_circuit=False):
+        """Compile the decision tree into a CompiledRule, which gives the
+            same results without walking the parse tree on every call
+
+        :param bool residues: False compiles an evaluator that only returns
+            the score, without the residues and flags that support it
+        :param bool short_circuit: True compiles AND, OR, and SELECT
+            expressions that stop as soon as their result is known
+        """
+        compiler = Compiler(residues, short_circuit)
+        return CompiledRule(self.rule, compiler(self.dtree), residues)
+
+    def compile_thresholds(self, thresholds):
+        """Compile the decision tree into a ThresholdRule, which scores a
+            sample at several variant frequency thresholds in one pass
+
+        :param thresholds: ascending frequencies, like (0.01, 0.05, 0.2)
+        """
+        compiler = Compiler(residues=False, thresholds=thresholds)
+        return ThresholdRule(self.rule,
+                             compiler(self.dtree),
+                             compiler.thresholds)
+
+    def profile(self, residues=True, short_circuit=False):
+        """Compile the decision tree into a ProfiledRule, which counts the
+            calls and time spent in each node
+
+        Rules that aren't being profiled have no timing overhead.
+        :param bool residues: False profiles the evaluator that only returns
+            the score
+        :param bool short_circuit: True profiles the evaluator that stops
+            as soon as each result is known
+        """
+        compiler = ProfilingCompiler(residues, short_circuit)
+        return ProfiledRule(self.rule,
+                            compiler(self.dtree),
+                            residues,
+                            compiler.profiles)
+
+    def __reduce__(self):
+        # parse trees hold grammar objects, so send the rule's IR instead
+        from pyvdrm.ir import rule_from_ir, rule_to_ir
+        return rule_from_ir, (rule_to_ir(self),)
+
     def __repr__(self):
         return self.rule
 
 
+class Compiler(object):
+    """Turns decision tree nodes into specialized closures"""
+
+    def __init__(self, residues=True, short_circuit=False, thresholds=None):
+        """ Initialize.
+
+        :param bool residues: True if the closures return Score objects with
+            supporting residues, False if they return bare score values
+        :param bool short_circuit: True if AND, OR, and SELECT closures stop
+            evaluating children once their result is known, which can't
+            report all the supporting residues
+        :param thresholds: ascending variant frequencies to evaluate at, all
+            at once, or None to treat every variant as present. Boolean
+            closures return an int with a bit set for each threshold where
+            they're true, starting from the lowest threshold, and score
+            closures return a list with a score for each threshold.
+        """
+        if residues and short_circuit:
+            raise ValueError('Short circuit evaluation needs residues=False.')
+        if thresholds is not None:
+            if residues:
+                raise ValueError(
+                    'Threshold evaluation needs residues=False.')
+            if short_circuit:
+                raise ValueError("Threshold evaluation can't short circuit.")
+            thresholds = tuple(thresholds)
+            if list(thresholds) != sorted(thresholds):
+                raise ValueError('Thresholds must be in ascending order.')
+        self.residues = residues
+        self.short_circuit = short_circuit
+        self.thresholds = thresholds
+        if thresholds is not None:
+            # a bit for each threshold
+            self.all_thresholds = (1 << len(thresholds)) - 1
+
+    def __call__(self, node):
+        return node.compile(self)
+
+
+class NodeProfile(object):
+    """Calls and time spent evaluating one node of a decision tree"""
+
+    __slots__ = ('span', 'label', 'calls', 'seconds')
+
+    def __init__(self, span, label):
+        """ Initialize.
+
+        :param span: the node's (start, end) offsets in the rule text
+        :param str label: the node's type
+        """
+        self.span = span
+        self.label = label
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return 'NodeProfile({!r}, {!r}, calls={}, seconds={})'.format(
+            self.span,
+            self.label,
+            self.calls,
+            self.seconds)
+
+
+class ProfilingCompiler(Compiler):
+    """Compiles closures that record a NodeProfile for each node
+
+    Nodes that have the same span as one of their children, like a list with
+    a single item, share the child's profile.
+    """
+
+    def __init__(self, residues=True, short_circuit=False, timer=perf_counter):
+        super().__init__(residues, short_circuit)
+        self.timer = timer
+        self.profiles = {}  # {span: NodeProfile}
+
+    def __call__(self, node):
+        evaluate = super().__call__(node)
+        span = getattr(node, 'span', None)
+        if span is None or span in self.profiles:
+            return evaluate
+        profile = NodeProfile(span, type(node).__name__)
+        self.profiles[span] = profile
+        timer = self.timer
+
+        def profiled(args):
+            start = timer()
+            try:
+                return evaluate(args)
+            finally:
+                profile.seconds += timer() - start
+                profile.calls += 1
+        return profiled
+
+
+class CompiledRule(object):
+    """A decision tree compiled into nested closures"""
+
+    def __init__(self, rule, evaluate, residues=True):
+        """ Initialize.
+
+        :param str rule: the rule string that was compiled
+        :param evaluate: callable that returns a Score for a set of mutations,
+            or just the score value if residues is False
+        :param bool residues: True if evaluate returns Score objects
+        """
+        self.rule = rule
+        self.evaluate = evaluate
+        self.residues = residues
+
+    def __call__(self, mutations):
+        score = self.evaluate(mutations)
+        if score is None:
+            return False
+        if self.residues:
+            return score.score
+        return score
+
+    def __repr__(self):
+        return 'CompiledRule({!r})'.format(self.rule)
+
+
+class ThresholdRule(CompiledRule):
+    """A decision tree compiled to score a sample at several variant
+        frequency thresholds at once
+
+    A variant counts as present at a threshold when its frequency is at
+    least the threshold. Variants without a frequency are always present.
+    """
+
+    def __init__(self, rule, evaluate, thresholds):
+        """ Initialize.
+
+        :param evaluate: callable that returns threshold bits or a list of
+            scores, from a Compiler with the same thresholds
+        :param thresholds: the ascending frequencies
+        """
+        super().__init__(rule, evaluate, residues=False)
+        self.thresholds = thresholds
+
+    def __call__(self, mutations):
+        """Evaluate the rule at every threshold.
+
+        :return: a list with the score at each threshold
+        """
+        result = self.evaluate(mutations)
+        if isinstance(result, list):
+            return list(result)
+        return [bool(result >> i & 1) for i in range(len(self.thresholds))]
+
+    def __repr__(self):
+        return 'ThresholdRule({!r}, {!r})'.format(self.rule, self.thresholds)
+
+
+class ProfiledRule(CompiledRule):
+    """A compiled rule that records the calls and time spent in each node"""
+
+    def __init__(self, rule, evaluate, residues=True, profiles=None):
+        """ Initialize.
+
+        :param profiles: {(start, end): NodeProfile} keyed by each node's
+            span in the rule text
+        """
+        super().__init__(rule, evaluate, residues)
+        self.profiles = profiles if profiles is not None else {}
+
+    def report(self):
+        """Annotate each node of the rule with its calls and time"""
+        lines = ['   calls    total ms  rule']
+        open_spans = []
+        for start, end in sorted(self.profiles, key=lambda s: (s[0], -s[1])):
+            while open_spans and open_spans[-1] <= start:
+                open_spans.pop()
+            profile = self.profiles[start, end]
+            text = ' '.join(self.rule[start:end].split())
+            lines.append('{:8} {:11.3f}  {}{}'.format(profile.calls,
+                                                       profile.seconds * 1000,
+                                                       '  ' * len(open_spans),
+                                                       text))
+            open_spans.append(end)
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'ProfiledRule({!r})'.format(self.rule)
+
+
 class AsiExpr(object):
     """A callable ASI2 expression"""
 
     children = []
     label = None
+    span = None  # (start, end) offsets in the rule text
 
     def __init__(self, _label, _pos, tokens):
         """By default we assume the head of the arg list is the operation"""
 
-        self.typecheck(tokens.asList())
+        # plain lists, so the tree doesn't hold any grammar objects
+        tokens = tokens.asList()
+        self.typecheck(tokens)
         self.children = tokens
 
         if not self.label:
@@ -60,13 +528,59 @@ class AsiExpr(object):
         """Evaluate child tokens with args"""
         return self.children(args)
 
+    def referenced_positions(self):
+        """Find the positions of all the residues in this expression"""
+        positions = set()
+        pending = [self.children]
+        while pending:
+            child = pending.pop()
+            if isinstance(child, list):
+                pending.extend(child)
+            elif hasattr(child, 'referenced_positions'):
+                positions.update(child.referenced_positions())
+        return positions
+
+    def structure_key(self):
+        """Describe this expression, so that identical expressions in
+            different places or rules can share their evaluation
+        """
+        key = [type(self)]
+        pending = [self.children]
+        while pending:
+            child = pending.pop(0)
+            if isinstance(child, list):
+                pending[:0] = child
+            elif hasattr(child, 'structure_key'):
+                key.append(child.structure_key())
+            else:
+                key.append(child)
+        return tuple(key)
+
+    def compile(self, compiler):
+        """Override compile to return a specialized callable, by default the
+            node interprets itself
+        """
+        if compiler.residues:
+            return self
+        if compiler.thresholds is not None:
+            raise NotImplementedError(
+                "{} can't be evaluated at thresholds.".format(
+                    type(self).__name__))
+
+        def score(args):
+            result = self(args)
+            if result is None:
+                return None
+            return result.score
+        return score
+
 
 class AsiBinaryExpr(AsiExpr):
     """Subclass with syntactic sugar for boolean ops"""
 
     def __init__(self, label, pos, tokens):
         super().__init__(label, pos, tokens)
-        self.children = tokens[0]
+        self.children = self.children[0]
 
     def typecheck(self, tokens):
         if len(tokens[0]) != 2:
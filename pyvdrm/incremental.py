@@ -0,0 +1,143 @@
+"""
+Re-score a sample after editing a few of its positions
+"""
+from collections import ChainMap
+
+from pyvdrm.drm import Compiler, CompiledRule
+
+# marks a memo slot that hasn't been evaluated for this sample
+_UNSET = object()
+
+
+class MemoizingCompiler(Compiler):
+    """Compiles closures that remember each node's result in a sample's memo
+
+    Only nodes that read positions get a memo slot, so the expressions that
+    SELECT calls with a count are left alone.
+    """
+
+    def __init__(self, residues=True):
+        super().__init__(residues)
+        self.nodes = []  # the node for each memo slot
+        self.index = {}  # {pos: [slot]} for every node that reads pos
+
+    def __call__(self, node):
+        evaluate = super().__call__(node)
+        positions = node.referenced_positions()
+        if not positions:
+            return evaluate
+        slot = len(self.nodes)
+        self.nodes.append(node)
+        for pos in positions:
+            self.index.setdefault(pos, []).append(slot)
+
+        def memoized(evaluation):
+            memo = evaluation.memo
+            result = memo[slot]
+            if result is _UNSET:
+                result = memo[slot] = evaluate(evaluation)
+                evaluation.evaluated += 1
+            return result
+        return memoized
+
+    def new_memo(self):
+        """Make an empty memo for a sample, with a slot for each node"""
+        return [_UNSET] * len(self.nodes)
+
+
+class Evaluation(object):
+    """Scores for one sample, with the memo that updates reuse
+
+    Rules read the sample through the positions attribute, so an evaluation
+    can stand in for the VariantCalls that it scored.
+    """
+
+    def __init__(self, positions, changes, memo):
+        """ Initialize.
+
+        :param positions: {pos: MutationSet} for the sample, including changes
+        :param changes: {pos: MutationSet} edited since the first evaluation
+        :param memo: result for each memo slot, or _UNSET
+        """
+        self.positions = positions
+        self.changes = changes
+        self.memo = memo
+        self.scores = {}  # {name: score}
+        self.evaluated = 0  # nodes evaluated, not found in the memo
+
+    def __repr__(self):
+        return 'Evaluation({!r})'.format(self.scores)
+
+
+class IncrementalScorer(object):
+    """Scores samples against a bank of rules, and re-scores only the parts
+    of the rules that read edited positions
+    """
+
+    def __init__(self, rules, residues=False):
+        """ Initialize.
+
+        :param rules: a mapping from names to parsed rules
+        :param bool residues: True to keep the residues and flags that
+            support each score in the memo, which doesn't change the scores
+        """
+        self._compiler = compiler = MemoizingCompiler(residues)
+        self.rules = []  # [(name, compiled rule)]
+        self.rule_names = []  # the rule name for each memo slot
+        for name, rule in rules.items():
+            compiled = CompiledRule(rule.rule, compiler(rule.dtree), residues)
+            self.rules.append((name, compiled))
+            self.rule_names.extend(
+                [name] * (len(compiler.nodes) - len(self.rule_names)))
+        self.nodes = compiler.nodes
+        self.index = compiler.index
+
+    def readers(self, pos):
+        """Find the rules and expressions that read a position.
+
+        :return: a list of (name, node) with each rule name and node
+        """
+        return [(self.rule_names[slot], self.nodes[slot])
+                for slot in self.index.get(pos, ())]
+
+    def evaluate(self, mutations):
+        """Score a sample against every rule.
+
+        :param mutations: the VariantCalls to score
+        :return: an Evaluation that can be passed to update()
+        """
+        try:
+            positions = mutations.positions
+        except AttributeError:
+            positions = {mutation_set.pos: mutation_set
+                         for mutation_set in mutations}
+        evaluation = Evaluation(positions, {}, self._compiler.new_memo())
+        self._score(evaluation)
+        return evaluation
+
+    def update(self, evaluation, delta):
+        """Score a sample again after editing some of its positions.
+
+        Only the expressions that read an edited position are evaluated
+        again, and the previous evaluation isn't changed.
+        :param Evaluation evaluation: the scores before the edit
+        :param delta: VariantCalls with the new mutation sets at each edited
+            position
+        :return: an Evaluation of the edited sample
+        """
+        changes = dict(evaluation.changes)
+        memo = list(evaluation.memo)
+        for mutation_set in delta:
+            changes[mutation_set.pos] = mutation_set
+            for slot in self.index.get(mutation_set.pos, ()):
+                memo[slot] = _UNSET
+        positions = evaluation.positions
+        if isinstance(positions, ChainMap):
+            positions = positions.maps[-1]
+        updated = Evaluation(ChainMap(changes, positions), changes, memo)
+        self._score(updated)
+        return updated
+
+    def _score(self, evaluation):
+        for name, rule in self.rules:
+            evaluation.scores[name] = rule(evaluation)
@@ -0,0 +1,189 @@
+"""
+Save parsed rules as JSON, and load them again without running a grammar
+
+A rule's IR is a dictionary that JSON can hold:
+
+    {"version": 1, "grammar": "asi2", "rule": "41L AND 67N",
+     "tree": {"type": "AndExpr", "span": [0, 11], "tokens": [[...]]}}
+
+Each node of the tree has the type and span of a decision tree node, and the
+tokens that the grammar passed to it, where a token is another node, a list
+of tokens, or a string. Loading calls each node's constructor with the same
+tokens, so a loaded rule evaluates exactly like the parsed one. Mutation
+leaves list their wild type, position and variants instead of tokens:
+
+    {"type": "AsiMutations", "span": [0, 3],
+     "wildtype": null, "pos": 41, "variants": ["L"]}
+"""
+import json
+
+from pyvdrm import asi2, hcvr
+from pyvdrm.drm import AsiBinaryExpr, AsiExpr
+from pyvdrm.vcf import intern_mutation_set
+
+IR_VERSION = 1
+
+LEAF_TYPES = (asi2.AsiMutations, hcvr.AsiMutations)
+
+GRAMMARS = {'asi2': asi2.ASI2, 'hcvr': hcvr.HCVR}
+
+NODE_TYPES = {
+    'asi2': {node_type.__name__: node_type
+             for node_type in (asi2.Negate,
+                               asi2.AndExpr,
+                               asi2.OrExpr,
+                               asi2.EqualityExpr,
+                               asi2.ScoreExpr,
+                               asi2.ScoreList,
+                               asi2.SelectFrom,
+                               asi2.AsiScoreCond,
+                               asi2.AsiMutations)},
+    'hcvr': {node_type.__name__: node_type
+             for node_type in (hcvr.BoolTrue,
+                               hcvr.BoolFalse,
+                               hcvr.AndExpr,
+                               hcvr.OrExpr,
+                               hcvr.EqualityExpr,
+                               hcvr.ScoreExpr,
+                               hcvr.ScoreList,
+                               hcvr.SelectFrom,
+                               hcvr.AsiScoreCond,
+                               hcvr.AsiMutations)}}
+
+
+class _Tokens(list):
+    """Stands in for the grammar's ParseResults when nodes are rebuilt"""
+
+    def asList(self):
+        return [token.asList() if isinstance(token, _Tokens) else token
+                for token in self]
+
+
+def rule_to_ir(rule):
+    """ Describe a parsed rule as a dictionary that JSON can hold.
+
+    :param rule: a parsed rule, like ASI2 or HCVR
+    :return: the rule's IR
+    """
+    for grammar, parser_class in GRAMMARS.items():
+        if isinstance(rule, parser_class):
+            break
+    else:
+        raise TypeError('No IR for {} rules.'.format(type(rule).__name__))
+    return {'version': IR_VERSION,
+            'grammar': grammar,
+            'rule': rule.rule,
+            'tree': _dump_node(rule.dtree)}
+
+
+def rule_from_ir(ir):
+    """ Rebuild a parsed rule from its IR, without parsing the rule text.
+
+    :param dict ir: the rule's IR from rule_to_ir()
+    :return: a parsed rule, like ASI2 or HCVR
+    """
+    _check_version(ir)
+    grammar = ir['grammar']
+    parser_class = GRAMMARS.get(grammar)
+    if parser_class is None:
+        raise ValueError('Unknown grammar in rule IR: {!r}.'.format(grammar))
+    dtree = _load_node(ir['tree'], NODE_TYPES[grammar], ir['rule'])
+    return parser_class(ir['rule'], dtree=dtree)
+
+
+def dump_rules(rules, f):
+    """ Write a bank of parsed rules to a JSON file.
+
+    :param rules: a mapping from names to parsed rules
+    :param f: an open text file to write to
+    """
+    rule_irs = {}
+    for name, rule in rules.items():
+        rule_ir = rule_to_ir(rule)
+        del rule_ir['version']
+        rule_irs[name] = rule_ir
+    json.dump({'version': IR_VERSION, 'rules': rule_irs},
+              f,
+              separators=(',', ':'))
+
+
+def load_rules(f):
+    """ Read a bank of parsed rules from a JSON file.
+
+    :param f: an open text file from dump_rules()
+    :return: a dictionary from names to parsed rules, in file order
+    """
+    bank = json.load(f)
+    _check_version(bank)
+    return {name: rule_from_ir(dict(rule_ir, version=bank['version']))
+            for name, rule_ir in bank['rules'].items()}
+
+
+def _check_version(ir):
+    version = ir.get('version')
+    if version != IR_VERSION:
+        raise ValueError('Unsupported rule IR version: {!r}.'.format(version))
+
+
+def _dump_node(node):
+    node_ir = {'type': type(node).__name__}
+    span = getattr(node, 'span', None)
+    if span is not None:
+        node_ir['span'] = list(span)
+    if isinstance(node, LEAF_TYPES):
+        # the text of a large set is its complement, without i and d
+        mutations = node.mutations
+        node_ir['wildtype'] = mutations.wildtype
+        node_ir['pos'] = mutations.pos
+        node_ir['variants'] = sorted(mutation.variant
+                                     for mutation in mutations.mutations)
+        return node_ir
+    tokens = node.children
+    if isinstance(node, AsiBinaryExpr):
+        # the operands were grouped in the first token
+        tokens = [tokens]
+    node_ir['tokens'] = _dump_tokens(tokens)
+    return node_ir
+
+
+def _dump_tokens(tokens):
+    dumped = []
+    for token in tokens:
+        if isinstance(token, str):
+            dumped.append(token)
+        elif isinstance(token, (AsiExpr,) + LEAF_TYPES):
+            dumped.append(_dump_node(token))
+        else:
+            dumped.append(_dump_tokens(token))
+    return dumped
+
+
+def _load_node(node_ir, node_types, rule):
+    type_name = node_ir['type']
+    node_type = node_types.get(type_name)
+    if node_type is None:
+        raise ValueError('Unknown node type in rule IR: {!r}.'.format(
+            type_name))
+    span = node_ir.get('span')
+    if issubclass(node_type, LEAF_TYPES):
+        node = node_type.__new__(node_type)
+        node.mutations = intern_mutation_set(wildtype=node_ir['wildtype'],
+                                             pos=node_ir['pos'],
+                                             variants=node_ir['variants'])
+    else:
+        tokens = _load_tokens(node_ir['tokens'], node_types, rule)
+        node = node_type(rule, 0 if span is None else span[0], tokens)
+    node.span = None if span is None else tuple(span)
+    return node
+
+
+def _load_tokens(tokens_ir, node_types, rule):
+    tokens = _Tokens()
+    for token in tokens_ir:
+        if isinstance(token, str):
+            tokens.append(token)
+        elif isinstance(token, dict):
+            tokens.append(_load_node(token, node_types, rule))
+        else:
+            tokens.append(_load_tokens(token, node_types, rule))
+    return tokens
@@ -0,0 +1,153 @@
+"""
+Score a stream of samples against a rules file from the command line
+
+    pyvdrm-score HIVDB.rules samples.fasta --jobs 8 > scores.ndjson
+
+The rules file has one rule per line, optionally after a name and a tab. The
+samples are aligned sequences in FASTA, where the first record is the
+reference unless --reference is given, or a tab-separated file with a sample
+id and a mutation list on each line, like "sample1<tab>41L 67N 70R".
+
+Each sample gets a line of JSON on stdout as soon as it's scored, in the same
+order as the input:
+
+    {"sample": "sample1", "scores": {"ABC": 15, "AZT": 0}}
+    {"sample": "sample2", "error": "Missing position 184."}
+"""
+import json
+import os
+import sys
+from argparse import ArgumentParser, FileType
+from collections import deque
+from itertools import chain
+
+from pyvdrm.bank import PARSERS, read_rules
+from pyvdrm.cohort import evaluate_cohort, parse_rule
+from pyvdrm.ir import load_rules
+from pyvdrm.vcf import read_fasta, read_mutation_tsv, read_reference
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(
+        description='Score samples against a rules file, and write a line '
+                    'of JSON for each sample.')
+    parser.add_argument('rules',
+                        type=FileType(),
+                        help='rules file, with an optional name and a tab '
+                             'before each rule, or parsed rules in .json')
+    parser.add_argument('samples',
+                        type=FileType(),
+                        help='FASTA or tab-separated mutation lists, '
+                             'or - for stdin')
+    parser.add_argument('--format',
+                        choices=('fasta', 'tsv'),
+                        help='sample format, default from the first line')
+    parser.add_argument('--reference',
+                        type=FileType(),
+                        help='FASTA file with the wild-type reference')
+    parser.add_argument('--grammar',
+                        choices=sorted(PARSERS),
+                        default='asi2',
+                        help='rule syntax, default asi2')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=1,
+                        help='worker processes, 0 for one per CPU, default 1')
+    return parser.parse_args(argv)
+
+
+def read_samples(lines, sample_format=None, reference=None):
+    """ Read samples in either format.
+
+    :param lines: an open file, or any other iterable of lines
+    :param str sample_format: 'fasta', 'tsv', or None to choose from the
+        first line that isn't blank or a comment
+    :param str reference: the wild-type reference
+    :return: a generator of (sample_id, VariantCalls)
+    """
+    lines = iter(lines)
+    if sample_format is None:
+        skipped = []
+        for line in lines:
+            skipped.append(line)
+            if line.strip() and not line.startswith('#'):
+                break
+        is_fasta = bool(skipped) and skipped[-1].startswith('>')
+        sample_format = 'fasta' if is_fasta else 'tsv'
+        lines = chain(skipped, lines)
+    if sample_format == 'fasta':
+        return read_fasta(lines, reference)
+    return read_mutation_tsv(lines, reference)
+
+
+def score_samples(rules, samples, jobs=1, parser_class=None):
+    """ Score samples, and describe the ones that can't be scored.
+
+    :param rules: a mapping from names to rule strings or parsed rules
+    :param samples: an iterable of (sample_id, VariantCalls)
+    :param int jobs: worker processes, 0 for one per CPU, 1 for none
+    :param parser_class: DRMParser subclass that parses the rules
+    :return: a generator of dictionaries to write as JSON, in input order
+    """
+    if parser_class is None:
+        parser_class = PARSERS['asi2']
+    # report bad rules here, not from the workers' initializers
+    rules = {name: parse_rule(rule, parser_class)
+             for name, rule in rules.items()}
+    sample_ids = deque()  # only holds the samples that are being scored
+
+    def read_calls():
+        for sample_id, calls in samples:
+            sample_ids.append(sample_id)
+            yield calls
+
+    if jobs == 0:
+        workers = None  # one per CPU
+    elif jobs == 1:
+        workers = 0  # score in this process
+    else:
+        workers = jobs
+    for scores in evaluate_cohort(rules,
+                                  read_calls(),
+                                  workers=workers,
+                                  return_errors=True):
+        result = {'sample': sample_ids.popleft()}
+        if isinstance(scores, Exception):
+            result['error'] = str(scores)
+        else:
+            result['scores'] = scores
+        yield result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rule_errors = ()
+    try:
+        with args.rules:
+            if args.rules.name.endswith('.json'):
+                rules = load_rules(args.rules)
+            else:
+                # only rule strings need the grammar
+                from pyparsing import ParseException
+                rule_errors = (ParseException,)
+                rules = read_rules(args.rules)
+        reference = None
+        if args.reference is not None:
+            with args.reference:
+                reference = read_reference(args.reference)
+        samples = read_samples(args.samples, args.format, reference)
+        for result in score_samples(rules,
+                                    samples,
+                                    args.jobs,
+                                    PARSERS[args.grammar]):
+            sys.stdout.write(json.dumps(result) + '\n')
+    except BrokenPipeError:
+        # the reader stopped early, like head, so quietly drop what's left
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    except (ValueError,) + rule_errors as ex:
+        sys.exit('pyvdrm-score: {}'.format(ex))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Score samples for other programs, with the rules loaded once
+
+Start the daemon with one or more rule files, each named after the file or
+with NAME=PATH:
+
+    python -m pyvdrm.serve --rules hivdb=HIVDB.rules --port 8765
+
+Each request is a line of JSON with a mutation list, or an aligned sample and
+its reference, and an optional id and rule bank name:
+
+    {"id": 1, "mutations": "41L 67N 70R"}
+    {"id": 2, "reference": "PQIT", "sample": "PQLT", "bank": "hivdb"}
+
+Each response is a line of JSON with the same id, and either the scores from
+every rule in the bank or an error message. Clients can send many requests
+without waiting, and responses come back in the same order.
+"""
+import asyncio
+import json
+import os
+import sys
+from argparse import ArgumentParser
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.bank import PARSERS, RuleBank, read_rules
+from pyvdrm.drm import MissingPositionError
+from pyvdrm.ir import load_rules
+from pyvdrm.vcf import VariantCalls
+
+
+def load_bank(path, parser_class=ASI2):
+    """Parse every rule in a rules file into a RuleBank, or load the parsed
+        rules from a .json file written by pyvdrm.ir.dump_rules()
+    """
+    with open(path) as rules_file:
+        if path.endswith('.json'):
+            return RuleBank(load_rules(rules_file))
+        rules = read_rules(rules_file)
+    return RuleBank({name: parser_class(rule) for name, rule in rules.items()})
+
+
+def check_types(request):
+    """Check that each field of a request has a type that can be scored
+
+    :raises ValueError: if a field has the wrong type
+    """
+    for field in ('mutations', 'reference', 'bank'):
+        value = request.get(field)
+        if value is not None and not isinstance(value, str):
+            raise ValueError('Request field {!r} must be a string.'.format(
+                field))
+    sample = request.get('sample')
+    if sample is not None and not (
+            isinstance(sample, str) or
+            (isinstance(sample, list) and
+             all(isinstance(amino, str) for amino in sample))):
+        raise ValueError(
+            "Request field 'sample' must be a string or a list of strings.")
+
+
+class ScoringServer(object):
+    """Answers scoring requests with warm rule banks"""
+
+    def __init__(self, banks):
+        """ Initialize.
+
+        :param banks: a mapping from names to RuleBank objects
+        """
+        self.banks = dict(banks)
+
+    def score(self, request):
+        """Score one request, and describe any problems in the response.
+
+        :param dict request: the decoded request
+        :return: a dictionary to send back as JSON
+        """
+        response = {'id': request.get('id')}
+        try:
+            check_types(request)
+            bank = self.find_bank(request.get('bank'))
+            if 'mutations' in request:
+                calls, = VariantCalls.parse_many([request['mutations']],
+                                                 request.get('reference'))
+            elif 'reference' in request and 'sample' in request:
+                calls = VariantCalls(reference=request['reference'],
+                                     sample=request['sample'])
+            else:
+                raise ValueError(
+                    'Request needs mutations, or a reference and a sample.')
+            response['scores'] = bank(calls)
+        except (ValueError, TypeError, MissingPositionError) as ex:
+            response['error'] = str(ex)
+        return response
+
+    def find_bank(self, name):
+        """Find a rule bank by name, or the only one if name is None"""
+        if name is None and len(self.banks) == 1:
+            bank, = self.banks.values()
+            return bank
+        try:
+            return self.banks[name]
+        except KeyError:
+            raise ValueError('Unknown rule bank: {!r}.'.format(name)) from None
+
+    def handle_line(self, line):
+        """Decode, score, and encode one request line"""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('Request must be a JSON object.')
+        except ValueError as ex:
+            response = {'id': None, 'error': 'Invalid request: {}'.format(ex)}
+        else:
+            response = self.score(request)
+        return json.dumps(response).encode('utf8') + b'\n'
+
+    async def handle_client(self, reader, writer):
+        """Answer requests from one connection until it closes"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                writer.write(self.handle_line(line))
+                # let other clients run between requests
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """ Start listening on a Unix socket or a TCP port.
+
+        :param str path: the Unix socket to listen on, instead of TCP
+        :param str host: the TCP address to listen on
+        :param int port: the TCP port to listen on, zero to pick a free one
+        :return: the asyncio server
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_client, path)
+        return await asyncio.start_server(self.handle_client, host, port)
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(
+        description='Score samples sent as lines of JSON with warm rules.')
+    parser.add_argument('--rules',
+                        action='append',
+                        required=True,
+                        metavar='[NAME=]PATH',
+                        help='rules file to load, can be repeated')
+    parser.add_argument('--grammar',
+                        choices=sorted(PARSERS),
+                        default='asi2',
+                        help='rule syntax, default asi2')
+    parser.add_argument('--socket', help='Unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    parser_class = PARSERS[args.grammar]
+    banks = {}
+    for rules_arg in args.rules:
+        name, equals, path = rules_arg.partition('=')
+        if not equals:
+            path = rules_arg
+            name = os.path.splitext(os.path.basename(path))[0]
+        banks[name] = load_bank(path, parser_class)
+    server = await ScoringServer(banks).start(args.socket,
+                                              args.host,
+                                              args.port)
+    for socket in server.sockets:
+        print('Listening on {}.'.format(socket.getsockname()),
+              file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Store a large cohort on disk, and read samples back without loading it all
+
+A store is a folder of flat arrays that NumPy maps into memory:
+
+    meta.json           format version, reference, and sample count
+    masks.bin           uint32 for each sample and reference position, with
+                        the same variant bits as MutationSet.mask
+    coverage.bin        uint32 (first, last) pairs of covered positions
+    coverage_index.bin  int64 offset of each sample's first coverage pair
+    sample_ids.jsonl    one JSON string for each sample
+
+Samples are read back as VariantCalls views that only build a MutationSet
+when a rule looks up its position. Views are pickled as the store's path and
+the sample's index, so worker processes map the same file and share its
+pages instead of copying samples.
+"""
+import json
+import os
+from collections.abc import Mapping
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError(
+        'pyvdrm.store needs NumPy, from the numpy extra: '
+        'pip install pyvdrm[numpy]') from None
+
+from pyvdrm.vcf import (AMINO_ALPHABET, CoveredMutationSets, CoveredPositions,
+                        VariantCalls, intern_mutation_set, variant_mask)
+
+STORE_VERSION = 1
+
+# the variants that can be stored, in the order of their mask bits
+STORED_VARIANTS = AMINO_ALPHABET + 'id'
+STORED_MASK = variant_mask(STORED_VARIANTS)
+
+MASK_TYPE = np.dtype('<u4')
+COVERAGE_TYPE = np.dtype('<u4')
+INDEX_TYPE = np.dtype('<i8')
+
+# stores opened by load_calls(), so each process maps a store once
+_open_stores = {}
+
+
+def write_store(path, samples, reference):
+    """ Write samples to a new store, reading one sample at a time.
+
+    Only the variants present are stored, not their frequencies.
+    :param str path: the folder to write, created if it doesn't exist
+    :param samples: an iterable of (sample_id, VariantCalls), like the
+        results from read_fasta()
+    :param str reference: the wild-type reference for every sample, which
+        sets the number of positions
+    :return: the number of samples written
+    """
+    unknown = set(reference) - set(STORED_VARIANTS)
+    if unknown:
+        raise ValueError('Only {} can be stored, not {} in the reference.'.format(
+            STORED_VARIANTS,
+            ''.join(sorted(unknown))))
+    os.makedirs(path, exist_ok=True)
+    reference_masks = np.array([variant_mask(wildtype)
+                                for wildtype in reference],
+                               dtype=MASK_TYPE)
+    sample_count = coverage_count = 0
+    with open(os.path.join(path, 'masks.bin'), 'wb') as masks_file, \
+            open(os.path.join(path, 'coverage.bin'), 'wb') as coverage_file, \
+            open(os.path.join(path, 'coverage_index.bin'),
+                 'wb') as index_file, \
+            open(os.path.join(path, 'sample_ids.jsonl'), 'w') as ids_file:
+        for sample_id, calls in samples:
+            masks, coverage = _sample_columns(calls,
+                                              reference,
+                                              reference_masks)
+            masks_file.write(masks.tobytes())
+            coverage_file.write(coverage.tobytes())
+            index_file.write(np.array([coverage_count],
+                                      dtype=INDEX_TYPE).tobytes())
+            ids_file.write(json.dumps(sample_id) + '\n')
+            coverage_count += len(coverage)
+            sample_count += 1
+        index_file.write(np.array([coverage_count],
+                                  dtype=INDEX_TYPE).tobytes())
+
+    # write the metadata last, so an incomplete store can't be opened
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({'version': STORE_VERSION,
+                   'reference': reference,
+                   'samples': sample_count},
+                  meta_file)
+    return sample_count
+
+
+def _sample_columns(calls, reference, reference_masks):
+    """Build a sample's masks and its coverage intervals
+
+    :raises ValueError: if the sample's wild types don't match the reference
+    """
+    positions = calls.positions
+    if isinstance(positions, CoveredPositions) and \
+            positions.reference == reference:
+        # only the variant positions differ from the reference
+        masks = reference_masks.copy()
+        for pos in positions.variant_positions:
+            masks[pos-1] = _stored_mask(positions[pos])
+        coverage = np.array([[1, len(masks)]], dtype=COVERAGE_TYPE)
+        return masks, coverage
+
+    masks = np.zeros(len(reference_masks), dtype=MASK_TYPE)
+    for mutation_set in calls:
+        if not 0 < mutation_set.pos <= len(masks):
+            raise ValueError('Position {} is outside the reference.'.format(
+                mutation_set.pos))
+        wildtype = reference[mutation_set.pos-1]
+        if mutation_set.wildtype not in (None, wildtype):
+            raise ValueError(
+                'Wild type mismatch between {} and reference {}{}.'.format(
+                    mutation_set,
+                    wildtype,
+                    mutation_set.pos))
+        masks[mutation_set.pos-1] = _stored_mask(mutation_set)
+    coverage = []
+    for pos in sorted(positions):
+        if coverage and coverage[-1][1] == pos - 1:
+            coverage[-1][1] = pos
+        else:
+            coverage.append([pos, pos])
+    return masks, np.array(coverage, dtype=COVERAGE_TYPE).reshape(-1, 2)
+
+
+def _stored_mask(mutation_set):
+    mask = mutation_set.mask
+    if mask & ~STORED_MASK:
+        raise ValueError('Only {} can be stored, not {}.'.format(
+            STORED_VARIANTS,
+            mutation_set))
+    return mask
+
+
+def load_calls(path, index):
+    """Read one sample from a store, mapping the store once per process"""
+    store = _open_stores.get(path)
+    if store is None:
+        store = _open_stores[path] = CohortStore(path)
+    return store[index]
+
+
+class CohortStore(object):
+    """A store of samples mapped into memory, read as VariantCalls views"""
+
+    def __init__(self, path):
+        """ Initialize.
+
+        :param str path: the folder written by write_store()
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        version = meta.get('version')
+        if version != STORE_VERSION:
+            raise ValueError('Unsupported cohort store version: {!r}.'.format(
+                version))
+        self.reference = meta['reference']
+        sample_count = meta['samples']
+        self.masks = self._map('masks.bin',
+                               MASK_TYPE,
+                               (sample_count, len(self.reference)))
+        self.coverage_index = self._map('coverage_index.bin',
+                                        INDEX_TYPE,
+                                        (sample_count + 1,))
+        self.coverage = self._map('coverage.bin',
+                                  COVERAGE_TYPE,
+                                  (int(self.coverage_index[-1]), 2))
+        self._sample_ids = None
+
+    def _map(self, name, dtype, shape):
+        if 0 in shape:
+            # empty files can't be mapped
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name),
+                         dtype=dtype,
+                         mode='r',
+                         shape=shape)
+
+    @property
+    def sample_ids(self):
+        """The id of each sample, read the first time they're needed"""
+        if self._sample_ids is None:
+            with open(os.path.join(self.path, 'sample_ids.jsonl')) as f:
+                self._sample_ids = [json.loads(line) for line in f]
+        return self._sample_ids
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __getitem__(self, index):
+        """Read a sample as a VariantCalls view of the mapped file"""
+        if not -len(self) <= index < len(self):
+            raise IndexError('Sample index {} out of range.'.format(index))
+        index %= len(self)
+        positions = StoredPositions(self, index)
+        # skip __new__, which would check the positions again
+        return tuple.__new__(StoredCalls, (CoveredMutationSets(positions),
+                                           self.reference,
+                                           positions))
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def __repr__(self):
+        return 'CohortStore({!r})'.format(self.path)
+
+
+class StoredPositions(Mapping):
+    """Positions of one sample in a store, built as they're looked up"""
+
+    def __init__(self, store, index):
+        """ Initialize.
+
+        :param CohortStore store: the store that holds the sample
+        :param int index: the sample's row in the store
+        """
+        self.store = store
+        self.index = index
+        self.masks = store.masks[index]  # a view, not a copy
+        start, end = store.coverage_index[index:index+2]
+        self.coverage = store.coverage[start:end].tolist()
+        self._mutation_sets = {}
+
+    def is_covered(self, pos):
+        for first, last in self.coverage:
+            if first <= pos <= last:
+                return True
+        return False
+
+    def get(self, pos, default=None):
+        mutation_set = self._mutation_sets.get(pos)
+        if mutation_set is None:
+            if not isinstance(pos, int) or not self.is_covered(pos):
+                return default
+            mask = int(self.masks[pos-1])
+            variants = ''.join(variant
+                               for i, variant in enumerate(STORED_VARIANTS)
+                               if mask >> i & 1)
+            mutation_set = intern_mutation_set(
+                pos=pos,
+                variants=variants,
+                wildtype=self.store.reference[pos-1])
+            self._mutation_sets[pos] = mutation_set
+        return mutation_set
+
+    def __getitem__(self, pos):
+        mutation_set = self.get(pos)
+        if mutation_set is None:
+            raise KeyError(pos)
+        return mutation_set
+
+    def __contains__(self, pos):
+        return isinstance(pos, int) and self.is_covered(pos)
+
+    def __iter__(self):
+        for first, last in self.coverage:
+            yield from range(first, last + 1)
+
+    def __len__(self):
+        return sum(last - first + 1 for first, last in self.coverage)
+
+    def __repr__(self):
+        return 'StoredPositions({!r}, {})'.format(self.store, self.index)
+
+
+class StoredCalls(VariantCalls):
+    """VariantCalls for a sample in a store, pickled by reference"""
+
+    def __reduce__(self):
+        positions = self.positions
+        return load_calls, (positions.store.path, positions.index)
+
+    def __repr__(self):
+        return 'StoredCalls({!r}, {})'.format(self.positions.store,
+                                               self.positions.index)
@@ -1,14 +1,22 @@
 import os
+import pickle
+import subprocess
+import sys
 import unittest
+from bisect import bisect_right
 
 from pyparsing import ParseException
 
-from pyvdrm.asi2 import ASI2, AsiMutations, Score
-from pyvdrm.drm import MissingPositionError
+from pyvdrm.asi2 import ASI2, AsiMutations, Score, grammar, TRUE, FALSE, ZERO
+from pyvdrm.drm import Compiler, MissingPositionError
 from pyvdrm.vcf import Mutation, MutationSet, VariantCalls
 
 from pyvdrm.tests.test_vcf import add_mutations
 
+# the folder that pyvdrm can be imported from
+PACKAGE_PARENT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 
 # noinspection SqlNoDataSourceInspection,SqlDialectInspection
 class TestRuleParser(unittest.TestCase):
@@ -30,6 +38,15 @@ class TestRuleParser(unittest.TestCase):
                                     r'Missing position 70.'):
             rule(VariantCalls('41L 67N'))
 
+    def test_mutation_set_list(self):
+        rule = ASI2("SELECT ATLEAST 2 FROM (41L, 67N, 70R)")
+        mutation_sets = [MutationSet('41L'), MutationSet('67N'),
+                         MutationSet('70d')]
+        self.assertTrue(rule(mutation_sets))
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 70.'):
+            rule(mutation_sets[:2])
+
     def test_stanford_ex3(self):
         ASI2("SELECT ATLEAST 2 AND NOTMORETHAN 2 FROM (41L, 67N, 70R, 210W, 215FY, 219QE)")
 
@@ -71,12 +88,31 @@ class TestRuleSemantics(unittest.TestCase):
 
     def test_score_residues(self):
         rule = ASI2("SCORE FROM ( 100G => 10, 101D => 20 )")
-        expected_residue = repr({Mutation('S100G')})
+        expected_residue = repr(frozenset({Mutation('S100G')}))
 
         result = rule.dtree(VariantCalls("S100G R101d"))
 
         self.assertEqual(expected_residue, repr(result.residues))
 
+    def test_score_residues_mixture(self):
+        rule = ASI2("SCORE FROM ( 100G => 10, 101D => 20 )")
+        expected_residue = repr(frozenset({Mutation('S100G')}))
+
+        result = rule.dtree(VariantCalls("S100GA R101d"))
+
+        self.assertEqual(expected_residue, repr(result.residues))
+
+    def test_wildtype_mismatch(self):
+        rule = ASI2("SCORE FROM ( S100G => 10 )")
+
+        with self.assertRaisesRegex(ValueError, r'Wild type mismatch'):
+            rule(VariantCalls("T100G"))
+        with self.assertRaisesRegex(ValueError, r'Wild type mismatch'):
+            rule(VariantCalls("T100G"), residues=False)
+        with self.assertRaisesRegex(ValueError, r'Wild type mismatch'):
+            rule.compile_thresholds([0.1])(VariantCalls("T100G"))
+        self.assertEqual(0, rule(VariantCalls("T100A"), residues=False))
+
     def test_score_from_max(self):
         rule = ASI2("SCORE FROM (MAX (100G => 10, 101D => 20, 102D => 30))")
         self.assertEqual(rule(VariantCalls("100G 101D 102d")), 20)
@@ -167,6 +203,273 @@ class TestActualRules(unittest.TestCase):
         self.assertEqual(rule(add_mutations("40F 67G 215Y")), 15)
 
 
+class TestRequiredPositions(unittest.TestCase):
+    def test_positions(self):
+        rule = ASI2("SCORE FROM ( (1G AND 2T) OR 3A => 7, "
+                    "MAX ( NOT 4E => 2, SELECT ATLEAST 1 FROM (5A, 6C) => 1 ) )")
+
+        self.assertEqual(frozenset(range(1, 7)), rule.required_positions)
+
+    def test_single_residue(self):
+        self.assertEqual(frozenset([41]), ASI2("41L").required_positions)
+
+    def test_hivdb_rules(self):
+        """ Every referenced position is needed, and no others. """
+        folder = os.path.dirname(__file__)
+        rules_file = os.path.join(folder, 'HIVDB.rules')
+        for line in open(rules_file):
+            rule = ASI2(line)
+            sample = VariantCalls(' '.join(
+                'K{}K'.format(pos) for pos in rule.required_positions))
+            rule.check_coverage(sample)
+            rule(sample)
+            for missing_pos in sorted(rule.required_positions)[::10]:
+                partial = VariantCalls(' '.join(
+                    'K{}K'.format(pos)
+                    for pos in rule.required_positions
+                    if pos != missing_pos))
+                with self.assertRaisesRegex(MissingPositionError,
+                                            r'Missing position {}\.'.format(
+                                                missing_pos)):
+                    rule(partial)
+
+    def test_check_coverage(self):
+        rule = ASI2("SCORE FROM ( 1G => 10, 2T AND 7Y => 5, 3A => 1 )")
+
+        rule.check_coverage(VariantCalls("1d 2T 3A 7Y"))
+        rule.check_coverage([MutationSet('1d'), MutationSet('2T'),
+                             MutationSet('3A'), MutationSet('7Y')])
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 7\.'):
+            rule.check_coverage(VariantCalls("1d 2T 3A"))
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing positions 2, 3, 7\.'):
+            rule.check_coverage(VariantCalls("1d"))
+
+    def test_check_coverage_sequence(self):
+        rule = ASI2("SCORE FROM ( 1G => 10, 5T => 5 )")
+
+        rule.check_coverage(VariantCalls(reference='ACHEA', sample='GCHEA'))
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 5\.'):
+            rule.check_coverage(VariantCalls(reference='ACHE', sample='GCHE'))
+
+
+class TestGrammar(unittest.TestCase):
+    def test_grammar_reused(self):
+        self.assertIs(grammar(), grammar())
+
+    def test_packrat(self):
+        # packrat parsing is global, so only enable it in another process
+        script = """\
+from pyvdrm.drm import enable_packrat
+from pyvdrm.asi2 import ASI2
+from pyvdrm.vcf import VariantCalls
+enable_packrat()
+rule = ASI2('SCORE FROM (MAX (100G => 10, 101D => 20), 102D => 30)')
+print(rule(VariantCalls('100G 101D 102D')))
+"""
+
+        output = subprocess.run([sys.executable, '-c', script],
+                                cwd=PACKAGE_PARENT,
+                                check=True,
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+
+        self.assertEqual('50\n', output)
+
+
+class TestCompile(unittest.TestCase):
+    def test_hivdb_rules(self):
+        folder = os.path.dirname(__file__)
+        rules_file = os.path.join(folder, 'HIVDB.rules')
+        samples = [cover_positions(text)
+                   for text in ("40F 41L 210W 215Y",
+                                "41L 67G 70R 184V 219Q",
+                                "46I 54V 82A 84V 90M",
+                                "10F 32I 47V 50V 54L 76V 84V")]
+        for line in open(rules_file):
+            rule = ASI2(line)
+            compiled = rule.compile()
+            for sample in samples:
+                expected = rule.dtree(sample)
+                result = compiled.evaluate(sample)
+                self.assertEqual(expected.score, result.score)
+                self.assertEqual(expected.residues, result.residues)
+                self.assertEqual(rule(sample), compiled(sample))
+                self.assertEqual(rule(sample), rule(sample, residues=False))
+                self.assertEqual(rule(sample), rule(sample,
+                                                    residues=False,
+                                                    short_circuit=True))
+
+    def test_boolean(self):
+        rule = ASI2("1G OR (2T AND 7Y)")
+        compiled = rule.compile()
+        self.assertTrue(compiled(VariantCalls("1d 2T 7Y")))
+        self.assertFalse(compiled(VariantCalls("1d 2T 7d")))
+        self.assertTrue(compiled(VariantCalls("1G 2d 7d")))
+
+    def test_select_from(self):
+        rule = ASI2("SELECT ATLEAST 2 FROM (2T, 7Y, 3G)")
+        compiled = rule.compile()
+        self.assertTrue(compiled(VariantCalls("2T 7Y 3d")))
+        self.assertFalse(compiled(VariantCalls("2T 7d 3d")))
+
+    def test_missing_position(self):
+        compiled = ASI2("SCORE FROM ( 100G => 10, 101D => 20 )").compile()
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 101.'):
+            compiled(VariantCalls("100G"))
+
+    def test_covered_sequence(self):
+        rule = ASI2("SCORE FROM ( 2T => 10, 3G => 20, NOT 4E => 5 )")
+        reference = 'ACHE'
+        sequence_calls = VariantCalls(reference=reference, sample='ATGE')
+        list_calls = VariantCalls(reference=reference,
+                                  sample=['A', 'T', 'G', 'E'])
+
+        for residues in (True, False):
+            self.assertEqual(rule(list_calls, residues=residues),
+                             rule(sequence_calls, residues=residues))
+        self.assertEqual(30, rule.compile()(sequence_calls))
+        self.assertEqual(30, rule.compile(residues=False)(sequence_calls))
+
+    def test_covered_sequence_missing_position(self):
+        rule = ASI2("SCORE FROM ( 2T => 10, 5G => 20 )")
+        calls = VariantCalls(reference='ACHE', sample='ATGE')
+
+        for residues in (True, False):
+            with self.assertRaisesRegex(MissingPositionError,
+                                        r'Missing position 5.'):
+                rule(calls, residues=residues)
+
+    def test_score_only(self):
+        rule = ASI2("SCORE FROM ( 100G => 10, 101D => 20, NOT 102D => 5 )")
+        compiled = rule.compile(residues=False)
+
+        self.assertEqual(30, compiled.evaluate(VariantCalls("100G 101D 102D")))
+        self.assertEqual(35, compiled(VariantCalls("100G 101D 102A")))
+        self.assertEqual(0, rule(VariantCalls("100d 101d 102D"),
+                                 residues=False))
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 102.'):
+            rule(VariantCalls("100G 101D"), residues=False)
+
+    def test_short_circuit_and(self):
+        rule = ASI2("1G AND 2T")
+        calls = VariantCalls("1d")
+
+        self.assertFalse(rule(calls, residues=False, short_circuit=True))
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 2.'):
+            rule(calls, residues=False)
+
+    def test_short_circuit_or(self):
+        compiled = ASI2("1G OR 2T").compile(residues=False,
+                                               short_circuit=True)
+
+        self.assertTrue(compiled(VariantCalls("1G")))
+        self.assertTrue(compiled(VariantCalls("1d 2T")))
+        self.assertFalse(compiled(VariantCalls("1d 2d")))
+
+    def test_short_circuit_select(self):
+        atleast = ASI2("SELECT ATLEAST 2 FROM (2T, 7Y, 3G)")
+        exactly = ASI2("SELECT EXACTLY 1 FROM (2T, 7Y, 3G)")
+
+        self.assertTrue(atleast(VariantCalls("2T 7Y"),
+                                residues=False,
+                                short_circuit=True))
+        self.assertFalse(atleast(VariantCalls("2d 7d"),
+                                 residues=False,
+                                 short_circuit=True))
+        self.assertFalse(exactly(VariantCalls("2T 7Y"),
+                                 residues=False,
+                                 short_circuit=True))
+        self.assertTrue(exactly(VariantCalls("2T 7d 3d"),
+                                residues=False,
+                                short_circuit=True))
+
+    def test_short_circuit_select_notmorethan(self):
+        rule = ASI2("SELECT NOTMORETHAN 1 FROM (2T, 7Y, 3G)")
+
+        # stops after the second match, without looking for position 3
+        self.assertFalse(rule(VariantCalls("2T 7Y"),
+                              residues=False,
+                              short_circuit=True))
+        self.assertTrue(rule(VariantCalls("2T 7d 3d"),
+                             residues=False,
+                             short_circuit=True))
+        self.assertFalse(rule(VariantCalls("2T 7Y 3G")))
+        self.assertTrue(rule(VariantCalls("2T 7d 3d")))
+        self.assertTrue(rule(VariantCalls("2T 7d 3d"), residues=False))
+        thresholds = ASI2("SELECT NOTMORETHAN 1 FROM (1T, 2Y, 3G)"
+                          ).compile_thresholds([0.1, 0.2])
+        self.assertEqual([False, True],
+                         thresholds(VariantCalls(
+                             reference='AYG',
+                             sample=['A', {'Y': 0.15}, {'G': 0.3}])))
+
+    def test_short_circuit_needs_score_only(self):
+        rule = ASI2("1G AND 2T")
+
+        with self.assertRaisesRegex(ValueError, r'needs residues=False'):
+            rule(VariantCalls("1G 2T"), short_circuit=True)
+
+    def test_repr(self):
+        compiled = ASI2("1G OR 2T").compile()
+        self.assertEqual("CompiledRule('1G OR 2T')", repr(compiled))
+
+
+class TestLevel(unittest.TestCase):
+    cutoffs = (10, 15, 30, 60)
+
+    def test_hivdb_rules(self):
+        folder = os.path.dirname(__file__)
+        rules_file = os.path.join(folder, 'HIVDB.rules')
+        samples = [cover_positions(text)
+                   for text in ("",
+                                "40F 41L 210W 215Y",
+                                "41L 67G 70R 184V 219Q",
+                                "46I 54V 82A 84V 90M",
+                                "10F 32I 47V 50V 54L 76V 84V")]
+        for line in open(rules_file):
+            rule = ASI2(line)
+            for sample in samples:
+                expected_level = bisect_right(self.cutoffs, rule(sample))
+
+                level, score = rule.level(sample, self.cutoffs)
+
+                self.assertEqual(expected_level, level)
+
+    def test_pruned(self):
+        rule = ASI2("SCORE FROM ( 101D => 5, MAX (100G => 60, 100S => 30) )")
+
+        level, score = rule.level(VariantCalls("100G"), self.cutoffs)
+
+        self.assertEqual((4, 60), (level, score))
+
+    def test_not_pruned(self):
+        rule = ASI2("SCORE FROM ( 101D => 5, MAX (100G => 60, 100S => 25) )")
+
+        level, score = rule.level(VariantCalls("100S 101D"), self.cutoffs)
+
+        self.assertEqual((3, 30), (level, score))
+
+    def test_negative_scores(self):
+        rule = ASI2("SCORE FROM ( 100G => 20, 101D => -10 )")
+
+        self.assertEqual((1, 10),
+                         rule.level(VariantCalls("100G 101D"), self.cutoffs))
+        self.assertEqual((2, 20),
+                         rule.level(VariantCalls("100G 101d"), self.cutoffs))
+
+    def test_boolean_rule(self):
+        rule = ASI2("100G AND 101D")
+
+        with self.assertRaisesRegex(TypeError, r'Levels need a score'):
+            rule.level(VariantCalls("100G 101D"), self.cutoffs)
+
+
 class TestAsiMutations(unittest.TestCase):
     def test_init_args(self):
         expected_mutation_set = MutationSet('Q80KR')
@@ -202,6 +505,144 @@ class TestScore(unittest.TestCase):
 
         self.assertEqual(expected_repr, r)
 
+    def test_residues_shared(self):
+        residues = frozenset({Mutation('A23R')})
+
+        score = Score(10, residues)
+
+        self.assertIs(residues, score.residues)
+
+    def test_residues_frozen(self):
+        residues = {Mutation('A23R')}
+
+        score = Score(10, residues)
+        residues.add(Mutation('A24R'))
+
+        self.assertEqual(frozenset({Mutation('A23R')}), score.residues)
+        with self.assertRaises(AttributeError):
+            score.residues.add(Mutation('A24R'))
+
+    def test_residues_copied(self):
+        score = Score(10, [Mutation('A23R')])
+
+        self.assertEqual({Mutation('A23R')}, score.residues)
+
+    def test_immutable(self):
+        score = Score(10, {Mutation('A23R')})
+
+        with self.assertRaises(AttributeError):
+            score.score = 20
+        with self.assertRaises(AttributeError):
+            score.other = 20
+
+    def test_add(self):
+        score1 = Score(10, {Mutation('A23R')})
+        score2 = Score(5, {Mutation('A24R')})
+
+        total = score1 + score2 + ZERO
+
+        self.assertEqual(15, total.score)
+        self.assertEqual({Mutation('A23R'), Mutation('A24R')}, total.residues)
+        self.assertEqual({Mutation('A23R')}, score1.residues)
+
+    def test_constants(self):
+        rule = ASI2("100G OR 101D")
+
+        result = rule.dtree(VariantCalls("100d 101d"))
+
+        self.assertIs(FALSE, result)
+        self.assertTrue(TRUE.score)
+        self.assertEqual(0, ZERO.score)
+
+    def test_pickle(self):
+        score = Score(10, set())
+
+        copy = pickle.loads(pickle.dumps(score))
+
+        self.assertEqual(score, copy)
+        self.assertEqual(score.residues, copy.residues)
+
+
+class TestThresholds(unittest.TestCase):
+    thresholds = (0.01, 0.05, 0.2)
+    reference = 'ACHE'
+    # H3R is called at 1% and 5%, and C2L at every threshold
+    sample = ['A', {'C': 0.7, 'L': 0.3}, {'H': 0.9, 'R': 0.1}, 'E']
+
+    def score(self, rule):
+        calls = VariantCalls(reference=self.reference, sample=self.sample)
+        return ASI2(rule).compile_thresholds(self.thresholds)(calls)
+
+    def test_boolean(self):
+        self.assertEqual([True, True, False], self.score('3R'))
+        self.assertEqual([True, True, True], self.score('2L'))
+        self.assertEqual([False, False, True], self.score('NOT 3R'))
+        self.assertEqual([True, True, True], self.score('2L AND 3HR'))
+        self.assertEqual([True, True, True], self.score('1A AND 2L AND 4E'))
+        self.assertEqual([True, True, False], self.score('1V OR 3R'))
+
+    def test_select(self):
+        rule = 'SELECT ATLEAST 2 FROM (2L, 3R, 4K)'
+
+        self.assertEqual([True, True, False], self.score(rule))
+
+    def test_score(self):
+        rule = 'SCORE FROM ( 2L => 10, 3R => 20, MAX ( 3RH => 5, 4K => 7 ) )'
+
+        self.assertEqual([35, 35, 15], self.score(rule))
+
+    def test_matches_calls_at_each_threshold(self):
+        rule = ASI2('SCORE FROM ( 2L AND NOT 3H => 10, '
+                    'SELECT EXACTLY 1 FROM (2L, 3R) => 4, '
+                    'MAX ( 2C => 1, 3R => 2 ) )')
+        compiled = rule.compile(residues=False)
+        calls = VariantCalls(reference=self.reference, sample=self.sample)
+        expected_scores = []
+        for threshold in self.thresholds:
+            sample = [''.join(variant
+                              for variant, frequency in alt.items()
+                              if frequency >= threshold)
+                      if isinstance(alt, dict) else alt
+                      for alt in self.sample]
+            expected_scores.append(compiled(
+                VariantCalls(reference=self.reference, sample=sample)))
+
+        scores = rule.compile_thresholds(self.thresholds)(calls)
+
+        self.assertEqual([2, 2, 5], expected_scores)
+        self.assertEqual(expected_scores, scores)
+
+    def test_without_frequencies(self):
+        rule = ASI2('SCORE FROM ( 1I => 10, 3R => 20 )')
+        calls = VariantCalls('A1I H3H')
+
+        self.assertEqual([10, 10], rule.compile_thresholds([0.1, 0.5])(calls))
+
+    def test_missing_position(self):
+        rule = ASI2('1I AND 3R').compile_thresholds([0.1])
+
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 3\.'):
+            rule(VariantCalls('A1I'))
+
+    def test_descending(self):
+        with self.assertRaisesRegex(ValueError,
+                                    r'Thresholds must be in ascending order\.'):
+            ASI2('1I').compile_thresholds([0.2, 0.1])
+
+    def test_residues(self):
+        with self.assertRaisesRegex(
+                ValueError, r'Threshold evaluation needs residues=False\.'):
+            Compiler(residues=True, thresholds=[0.1])
+
+
+def cover_positions(text, length=600):
+    """ Add mutations to a wild type that covers every position. """
+    seq = ['K'] * length
+    for mutation_set in VariantCalls(text):
+        seq[mutation_set.pos - 1] = [m.variant for m in mutation_set]
+    return VariantCalls(reference='K' * length, sample=seq)
+
 
 if __name__ == '__main__':
     unittest.main()
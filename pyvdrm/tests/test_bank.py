@@ -0,0 +1,82 @@
+import unittest
+from io import StringIO
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.bank import BankInfo, RuleBank, read_rules
+from pyvdrm.drm import MissingPositionError
+from pyvdrm.hcvr import HCVR
+from pyvdrm.vcf import VariantCalls
+
+from pyvdrm.tests.test_asi2 import cover_positions
+from pyvdrm.tests.test_incremental import read_hivdb_rules
+
+
+class TestReadRules(unittest.TestCase):
+    def test_names(self):
+        rules_file = StringIO('''\
+# comment
+abc\t1I AND 3R
+
+2L OR 4K
+''')
+        expected_rules = {'abc': '1I AND 3R', '4': '2L OR 4K'}
+
+        rules = read_rules(rules_file)
+
+        self.assertEqual(expected_rules, rules)
+
+
+class TestRuleBank(unittest.TestCase):
+    def test_shared_expressions(self):
+        bank = RuleBank({'a': ASI2('SCORE FROM ( 1I => 10, 2L AND 3R => 5 )'),
+                         'b': ASI2('SCORE FROM ( 2L AND 3R => 5, 4K => 1 )'),
+                         'c': ASI2('2L AND 3R')})
+        calls = VariantCalls('1I 2L 3R 4K')
+        expected_scores = {'a': 15, 'b': 6, 'c': True}
+
+        evaluation = bank.evaluate(calls)
+
+        self.assertEqual(expected_scores, evaluation.scores)
+        # 2L AND 3R => 5 is only evaluated once, along with its children
+        self.assertEqual(BankInfo(rules=3, nodes=19, shared_nodes=12),
+                         bank.info())
+        self.assertEqual(12, evaluation.evaluated)
+
+    def test_call(self):
+        bank = RuleBank()
+        bank.add('a', ASI2('1I OR 2L'))
+        bank.add('b', ASI2('SELECT ATLEAST 2 FROM (1I, 2L, 3R)'))
+
+        self.assertEqual({'a': True, 'b': False}, bank(VariantCalls('1I 2C 3C')))
+        self.assertEqual({'a': True, 'b': True}, bank(VariantCalls('1I 2L 3C')))
+
+    def test_different_grammars(self):
+        """ Identical text in different grammars isn't shared. """
+        bank = RuleBank({'asi2': ASI2('SCORE FROM ( 1I => 10 )'),
+                         'hcvr': HCVR('SCORE FROM ( 1I => 10 )')})
+
+        self.assertEqual({'asi2': 10, 'hcvr': 10}, bank(VariantCalls('1I')))
+        self.assertEqual(8, bank.info().shared_nodes)
+
+    def test_missing_position(self):
+        bank = RuleBank({'a': ASI2('1I OR 2L')})
+
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 2\.'):
+            bank(VariantCalls('1I'))
+
+    def test_hivdb_rules(self):
+        rules = read_hivdb_rules(ASI2)
+        samples = [cover_positions(text)
+                   for text in ("40F 41L 210W 215Y",
+                                "41L 67G 70R 184V 219Q",
+                                "46I 54V 82A 84V 90M",
+                                "10F 32I 47V 50V 54L 76V 84V")]
+        for residues in (False, True):
+            bank = RuleBank(rules, residues=residues)
+            info = bank.info()
+            self.assertLess(info.shared_nodes * 2, info.nodes)
+            for sample in samples:
+                expected_scores = {name: rule(sample)
+                                   for name, rule in rules.items()}
+                self.assertEqual(expected_scores, bank(sample))
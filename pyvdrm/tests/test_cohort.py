@@ -0,0 +1,100 @@
+import unittest
+
+from pyvdrm.cohort import compile_rules, evaluate_cohort, score_sample
+from pyvdrm.drm import MissingPositionError
+from pyvdrm.hcvr import HCVR
+from pyvdrm.vcf import VariantCalls
+
+RULES = {'score': 'SCORE FROM ( 1I => 10, 3R => 20, MAX (2L => 5, 2C => 1) )',
+         'bool': '1I AND 3R'}
+REFERENCE = 'ACHE'
+
+
+def make_samples():
+    return (VariantCalls(reference=REFERENCE, sample=sample)
+            for sample in ['ICRE', 'ACHE', 'ILHE', 'ICHE', 'ACRE'])
+
+
+class TestEvaluateCohort(unittest.TestCase):
+    expected_results = [{'score': 31, 'bool': True},
+                        {'score': 1, 'bool': False},
+                        {'score': 15, 'bool': False},
+                        {'score': 11, 'bool': False},
+                        {'score': 21, 'bool': False}]
+
+    def test_in_process(self):
+        results = list(evaluate_cohort(RULES, make_samples(), workers=0))
+
+        self.assertEqual(self.expected_results, results)
+
+    def test_pool(self):
+        results = list(evaluate_cohort(RULES,
+                                       make_samples(),
+                                       workers=2,
+                                       chunksize=2))
+
+        self.assertEqual(self.expected_results, results)
+
+    def test_parser_class(self):
+        rules = {'score': 'SCORE FROM ( 1I => 10, 3R => 20 )'}
+        samples = [VariantCalls(reference=REFERENCE, sample='ICRE')]
+        expected_results = [{'score': 30}]
+
+        results = list(evaluate_cohort(rules,
+                                       samples,
+                                       workers=1,
+                                       parser_class=HCVR))
+
+        self.assertEqual(expected_results, results)
+
+    def test_missing_position(self):
+        samples = [VariantCalls('A1I C2C')]
+
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 3\.'):
+            list(evaluate_cohort(RULES, samples, workers=1))
+
+    def test_return_errors(self):
+        samples = [VariantCalls('A1I C2C H3R E4E'), VariantCalls('A1I C2C')]
+
+        for workers in (0, 1):
+            results = list(evaluate_cohort(RULES,
+                                           samples,
+                                           workers=workers,
+                                           return_errors=True))
+
+            self.assertEqual({'score': 31, 'bool': True}, results[0])
+            self.assertIsInstance(results[1], MissingPositionError)
+            self.assertEqual('Missing position 3.', str(results[1]))
+
+    def test_reads_samples_in_batches(self):
+        read_count = 0
+
+        def read_samples():
+            nonlocal read_count
+            for _ in range(100):
+                read_count += 1
+                yield VariantCalls(reference=REFERENCE, sample='ICRE')
+
+        results = evaluate_cohort(RULES, read_samples(), workers=1, chunksize=2)
+        first_result = next(results)
+        first_read_count = read_count
+        remaining_results = list(results)
+
+        self.assertEqual(self.expected_results[0], first_result)
+        # two batches of 8 samples for the one worker
+        self.assertEqual(16, first_read_count)
+        self.assertEqual(99, len(remaining_results))
+
+
+class TestScoreSample(unittest.TestCase):
+    def test_score(self):
+        compiled_rules = compile_rules(RULES)
+        sample = VariantCalls(reference=REFERENCE, sample='ILRE')
+        expected_scores = {'score': 35, 'bool': True}
+
+        scores = score_sample(compiled_rules, sample)
+
+        self.assertEqual(expected_scores, scores)
+        self.assertEqual(['score', 'bool'],
+                         [name for name, _ in compiled_rules])
@@ -0,0 +1,180 @@
+import unittest
+
+from pyparsing import ParseException
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.drm import CacheInfo, RuleCache, normalize_rule, rule_cache
+from pyvdrm.hcvr import HCVR
+from pyvdrm.vcf import VariantCalls
+
+
+class TestNormalizeRule(unittest.TestCase):
+    def test_white_space(self):
+        expected_rule = 'SCORE FROM ( 100G => 10 )'
+
+        rule = normalize_rule('\n  SCORE FROM (\n\t100G =>   10 )\n')
+
+        self.assertEqual(expected_rule, rule)
+
+
+class TestRuleCache(unittest.TestCase):
+    def test_hit(self):
+        cache = RuleCache()
+
+        rule1 = cache.get(ASI2, 'SCORE FROM ( 100G => 10 )')
+        rule2 = cache.get(ASI2, 'SCORE FROM (  100G => 10 )\n')
+
+        self.assertIs(rule1, rule2)
+        self.assertEqual(CacheInfo(hits=1, misses=1, maxsize=1024, currsize=1),
+                         cache.info())
+
+    def test_parser_classes(self):
+        cache = RuleCache()
+
+        rule1 = cache.get(ASI2, '100G')
+        rule2 = cache.get(HCVR, '100G')
+
+        self.assertIsInstance(rule1, ASI2)
+        self.assertIsInstance(rule2, HCVR)
+        self.assertEqual(2, cache.info().misses)
+
+    def test_evict_least_recent(self):
+        cache = RuleCache(maxsize=2)
+        rule1 = cache.get(ASI2, '1G')
+        rule2 = cache.get(ASI2, '2G')
+        cache.get(ASI2, '1G')
+        cache.get(ASI2, '3G')
+
+        self.assertIs(rule1, cache.get(ASI2, '1G'))
+        self.assertIsNot(rule2, cache.get(ASI2, '2G'))
+        self.assertEqual(CacheInfo(hits=2, misses=4, maxsize=2, currsize=2),
+                         cache.info())
+
+    def test_parse_error_not_cached(self):
+        cache = RuleCache()
+
+        with self.assertRaises(ParseException):
+            cache.get(ASI2, 'SCORE FROM ( 10R => 2;0 )')
+
+        self.assertEqual(0, cache.info().currsize)
+
+    def test_clear(self):
+        cache = RuleCache()
+        cache.get(ASI2, '1G')
+
+        cache.clear()
+
+        self.assertEqual(CacheInfo(hits=0, misses=0, maxsize=1024, currsize=0),
+                         cache.info())
+
+
+class TestFromCached(unittest.TestCase):
+    def setUp(self):
+        rule_cache.clear()
+
+    def test_from_cached(self):
+        rule1 = ASI2.from_cached('SCORE FROM ( 100G => 10, 101D => 20 )')
+        rule2 = ASI2.from_cached('SCORE FROM ( 100G => 10, 101D => 20 )')
+
+        self.assertIs(rule1, rule2)
+        self.assertEqual(10, rule2(VariantCalls('100G 101d')))
+        self.assertEqual(1, rule_cache.info().hits)
+
+    def test_from_cached_hcvr(self):
+        rule = HCVR.from_cached('SCORE FROM ( 100G => 10, 101D => 20 )')
+
+        self.assertIsInstance(rule, HCVR)
+
+
+class TestProfile(unittest.TestCase):
+    def test_spans(self):
+        rule = ASI2('SCORE FROM ( (1I AND 2L) OR 3R => 7, MAX ( NOT 4E => 2 ) )')
+        expected_texts = ['SCORE FROM ( (1I AND 2L) OR 3R => 7, '
+                          'MAX ( NOT 4E => 2 ) )',
+                          '(1I AND 2L) OR 3R => 7',
+                          '(1I AND 2L) OR 3R',
+                          '1I AND 2L',
+                          '1I',
+                          '2L',
+                          '3R',
+                          'MAX ( NOT 4E => 2 )',
+                          'NOT 4E => 2',
+                          'NOT 4E',
+                          '4E']
+
+        profiled = rule.profile()
+        texts = [rule.rule[start:end]
+                 for start, end in sorted(profiled.profiles,
+                                          key=lambda s: (s[0], -s[1]))]
+
+        self.assertEqual(expected_texts, texts)
+
+    def test_spans_grouped_operands(self):
+        rule = HCVR('((1I AND 2L)) OR (3R AND 4E)')
+        expected_texts = ['((1I AND 2L)) OR (3R AND 4E)',
+                          '1I AND 2L',
+                          '1I',
+                          '2L',
+                          '3R AND 4E',
+                          '3R',
+                          '4E']
+
+        profiled = rule.profile()
+        texts = [rule.rule[start:end]
+                 for start, end in sorted(profiled.profiles,
+                                          key=lambda s: (s[0], -s[1]))]
+
+        self.assertEqual(expected_texts, texts)
+
+    def test_counts(self):
+        rule = ASI2('SCORE FROM ( 1I => 10, SELECT ATLEAST 1 FROM (2L, 3R) '
+                    '=> 5 )')
+        calls = VariantCalls(reference='ACHE', sample='ILRE')
+        profiled = rule.profile(residues=False)
+
+        scores = [profiled(calls), profiled(calls)]
+        profiles = {rule.rule[start:end]: profile
+                    for (start, end), profile in profiled.profiles.items()}
+
+        self.assertEqual([15, 15], scores)
+        self.assertEqual(2, profiles['2L'].calls)
+        self.assertEqual('AsiMutations', profiles['2L'].label)
+        self.assertEqual('SelectFrom',
+                         profiles['SELECT ATLEAST 1 FROM (2L, 3R)'].label)
+        self.assertEqual(2, profiles[rule.rule].calls)
+        self.assertGreater(profiles[rule.rule].seconds,
+                           profiles['2L'].seconds)
+
+    def test_short_circuit(self):
+        rule = HCVR('1I OR 2L')
+        profiled = rule.profile(residues=False, short_circuit=True)
+
+        self.assertTrue(profiled(VariantCalls('1I')))
+        profiles = {rule.rule[start:end]: profile
+                    for (start, end), profile in profiled.profiles.items()}
+
+        self.assertEqual(1, profiles['1I'].calls)
+        self.assertEqual(0, profiles['2L'].calls)
+
+    def test_report(self):
+        rule = HCVR('SCORE FROM ( TRUE => 10, 1I AND 2L => 2 )')
+        profiled = rule.profile()
+        profiled(VariantCalls('1I 2C'))
+        expected_rules = ['SCORE FROM ( TRUE => 10, 1I AND 2L => 2 )',
+                          '  TRUE => 10, 1I AND 2L => 2',
+                          '    TRUE => 10',
+                          '      TRUE',
+                          '    1I AND 2L => 2',
+                          '      1I AND 2L',
+                          '        1I',
+                          '        2L']
+
+        lines = profiled.report().splitlines()
+
+        self.assertEqual('   calls    total ms  rule', lines[0])
+        self.assertEqual(['1'] * 8, [line.split()[0] for line in lines[1:]])
+        self.assertEqual(expected_rules, [line[22:] for line in lines[1:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import unittest
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.drm import MissingPositionError
+from pyvdrm.hcvr import HCVR
+from pyvdrm.incremental import IncrementalScorer
+from pyvdrm.vcf import VariantCalls
+
+from pyvdrm.tests.test_asi2 import cover_positions
+
+
+def read_hivdb_rules(parser_class):
+    folder = os.path.dirname(__file__)
+    rules_file = os.path.join(folder, 'HIVDB.rules')
+    with open(rules_file) as rules:
+        return {i: parser_class(line)
+                for i, line in enumerate(rules)
+                if line.strip()}
+
+
+class TestIncrementalScorer(unittest.TestCase):
+    def setUp(self):
+        self.rules = {
+            'a': ASI2('SCORE FROM ( 1I => 10, 2L AND 3R => 20, '
+                      'MAX ( 4K => 5, 4Q => 3 ) )'),
+            'b': ASI2('SELECT ATLEAST 2 FROM (1I, 3R, 5A)'),
+            'c': ASI2('5A OR 6C')}
+        self.scorer = IncrementalScorer(self.rules)
+        self.reference = 'ACHEAC'
+
+    def test_evaluate(self):
+        calls = VariantCalls(reference=self.reference, sample='ILRQAC')
+        expected_scores = {'a': 33, 'b': True, 'c': True}
+
+        evaluation = self.scorer.evaluate(calls)
+
+        self.assertEqual(expected_scores, evaluation.scores)
+
+    def test_update(self):
+        calls = VariantCalls(reference=self.reference, sample='ILRQAC')
+        evaluation = self.scorer.evaluate(calls)
+        expected_scores = {'a': 13, 'b': True, 'c': True}
+
+        updated = self.scorer.update(evaluation, VariantCalls('H3H'))
+
+        self.assertEqual(expected_scores, updated.scores)
+        # 3R, AND, its score, its list, and the condition in 'a', and 3R and
+        # SELECT in 'b'
+        self.assertEqual(7, updated.evaluated)
+        self.assertEqual({'a': 33, 'b': True, 'c': True}, evaluation.scores)
+
+    def test_update_twice(self):
+        calls = VariantCalls(reference=self.reference, sample='ILRQAC')
+        evaluation = self.scorer.evaluate(calls)
+
+        updated = self.scorer.update(evaluation, VariantCalls('H3H'))
+        updated = self.scorer.update(updated, VariantCalls('A5A'))
+        updated = self.scorer.update(updated, VariantCalls('A1A'))
+
+        self.assertEqual({'a': 3, 'b': False, 'c': True}, updated.scores)
+        self.assertEqual({3: VariantCalls('H3H').positions[3],
+                          5: VariantCalls('A5A').positions[5],
+                          1: VariantCalls('A1A').positions[1]},
+                         updated.changes)
+
+    def test_unread_position(self):
+        calls = VariantCalls(reference=self.reference + 'K', sample='ILRQACK')
+        evaluation = self.scorer.evaluate(calls)
+
+        updated = self.scorer.update(evaluation, VariantCalls('K7R'))
+
+        self.assertEqual(evaluation.scores, updated.scores)
+        self.assertEqual(0, updated.evaluated)
+
+    def test_missing_position(self):
+        with self.assertRaisesRegex(MissingPositionError,
+                                    r'Missing position 6\.'):
+            self.scorer.evaluate(VariantCalls('1I 2L 3R 4Q 5A'))
+
+    def test_readers(self):
+        readers = self.scorer.readers(3)
+
+        self.assertEqual(['a', 'a', 'a', 'a', 'a', 'b', 'b'],
+                         [name for name, _ in readers])
+        self.assertEqual('AsiMutations', type(readers[0][1]).__name__)
+        self.assertEqual([], self.scorer.readers(7))
+
+    def test_hivdb_rules(self):
+        rules = read_hivdb_rules(ASI2)
+        scorer = IncrementalScorer(rules, residues=True)
+        edits = [('41L 210W 215Y', '41L 67G 210W 215Y', 'K67G'),
+                 ('46I 54V 82A 84V 90M', '46I 54V 82A 84V', 'K90K'),
+                 ('41L 67G 70R 184V 219Q', '41L 67G 184V 219Q', 'K70K')]
+        for before, after, delta in edits:
+            evaluation = scorer.evaluate(cover_positions(before))
+            updated = scorer.update(evaluation, VariantCalls(delta))
+            after_calls = cover_positions(after)
+            expected_scores = {name: rule(after_calls)
+                               for name, rule in rules.items()}
+
+            self.assertEqual(expected_scores, updated.scores)
+            self.assertLess(updated.evaluated * 5, evaluation.evaluated)
+
+    def test_hcvr(self):
+        rules = {'a': HCVR('SCORE FROM ( 1I => 10, 2L AND 3!R => 20 )')}
+        scorer = IncrementalScorer(rules)
+        evaluation = scorer.evaluate(VariantCalls('1I 2L 3R'))
+
+        updated = scorer.update(evaluation, VariantCalls('3H'))
+
+        self.assertEqual({'a': 10}, evaluation.scores)
+        self.assertEqual({'a': 30}, updated.scores)
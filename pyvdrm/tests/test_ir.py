@@ -0,0 +1,182 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+import unittest
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.hcvr import HCVR
+from pyvdrm.ir import (IR_VERSION, rule_to_ir, rule_from_ir, dump_rules,
+                       load_rules)
+from pyvdrm.vcf import VariantCalls
+
+from pyvdrm.tests.test_asi2 import cover_positions
+from pyvdrm.tests.test_incremental import read_hivdb_rules
+
+# the folder that pyvdrm can be imported from
+PACKAGE_PARENT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def round_trip(rule):
+    return rule_from_ir(json.loads(json.dumps(rule_to_ir(rule))))
+
+
+class TestRuleIr(unittest.TestCase):
+    def test_ir(self):
+        rule = ASI2('41L AND NOT 67N')
+        expected_ir = {
+            'version': IR_VERSION,
+            'grammar': 'asi2',
+            'rule': '41L AND NOT 67N',
+            'tree': {'type': 'AndExpr',
+                     'span': [0, 15],
+                     'tokens': [[{'type': 'AsiMutations',
+                                  'span': [0, 3],
+                                  'wildtype': None,
+                                  'pos': 41,
+                                  'variants': ['L']},
+                                 {'type': 'Negate',
+                                  'span': [8, 15],
+                                  'tokens': [{'type': 'AsiMutations',
+                                              'span': [12, 15],
+                                              'wildtype': None,
+                                              'pos': 67,
+                                              'variants': ['N']}]}]]}}
+
+        ir = rule_to_ir(rule)
+
+        self.assertEqual(expected_ir, ir)
+
+    def test_asi2_round_trip(self):
+        rule = ASI2('SCORE FROM ( MAX ( 1I => 10, 1L => 5 ), '
+                    '2L AND (3R OR NOT 4E) => -2, '
+                    'SELECT ATLEAST 2 FROM (1I, 2L, 3R) '
+                    '=> 7 )')
+        calls = VariantCalls('A1I C2L H3R E4E')
+
+        loaded = round_trip(rule)
+
+        self.assertIsInstance(loaded, ASI2)
+        self.assertEqual(rule.rule, loaded.rule)
+        self.assertEqual(rule.dtree.structure_key(),
+                         loaded.dtree.structure_key())
+        self.assertEqual(rule(calls), loaded(calls))
+        self.assertEqual(rule.dtree(calls).residues,
+                         loaded.dtree(calls).residues)
+        self.assertEqual(rule.required_positions, loaded.required_positions)
+        self.assertEqual(rule.profile().profiles.keys(),
+                         loaded.profile().profiles.keys())
+
+    def test_hcvr_round_trip(self):
+        rule = HCVR('SCORE FROM ( MIN ( 1!I => 10, 2L => "flag a" ), '
+                    'TRUE => 3, FALSE => 1 )')
+        calls = VariantCalls('A1A C2L')
+
+        loaded = round_trip(rule)
+
+        self.assertIsInstance(loaded, HCVR)
+        self.assertEqual(13, loaded(calls))
+        self.assertEqual(rule.dtree(calls).flags, loaded.dtree(calls).flags)
+
+    def test_large_mutation_sets(self):
+        # more than 10 variants are written as a complement, without i and d
+        calls = VariantCalls('A70d D71i')
+        for parser_class in (ASI2, HCVR):
+            rule = parser_class('SCORE FROM ( 70ACDEFGHIKLd => 5, '
+                                'D71ACDEFGHIKLMi => 3 )')
+
+            for loaded in (round_trip(rule),
+                           pickle.loads(pickle.dumps(rule))):
+                self.assertEqual(rule.dtree.structure_key(),
+                                 loaded.dtree.structure_key())
+                self.assertEqual(8, rule(calls))
+                self.assertEqual(8, loaded(calls))
+
+    def test_pickle(self):
+        rule = ASI2('1I OR 2L')
+        rule.compile()  # compiled closures aren't pickled
+
+        loaded = pickle.loads(pickle.dumps(rule))
+
+        self.assertTrue(loaded(VariantCalls('A1I C2C')))
+        self.assertEqual(rule.dtree.structure_key(),
+                         loaded.dtree.structure_key())
+
+    def test_unsupported_version(self):
+        ir = dict(rule_to_ir(ASI2('1I')), version=IR_VERSION + 1)
+
+        with self.assertRaisesRegex(
+                ValueError,
+                r'Unsupported rule IR version: {}\.'.format(IR_VERSION + 1)):
+            rule_from_ir(ir)
+
+    def test_unknown_node_type(self):
+        ir = rule_to_ir(ASI2('1I'))
+        ir['tree']['type'] = 'BoolTrue'  # only in HCVR
+
+        with self.assertRaisesRegex(
+                ValueError, r"Unknown node type in rule IR: 'BoolTrue'\."):
+            rule_from_ir(ir)
+
+    def test_unknown_grammar(self):
+        ir = dict(rule_to_ir(ASI2('1I')), grammar='asi3')
+
+        with self.assertRaisesRegex(ValueError,
+                                    r"Unknown grammar in rule IR: 'asi3'\."):
+            rule_from_ir(ir)
+
+
+class TestDumpRules(unittest.TestCase):
+    def test_hivdb(self):
+        rules = read_hivdb_rules(ASI2)
+        calls = cover_positions('41L 67N 70R 103N 184V 215Y 219Q')
+        f = StringIO()
+
+        dump_rules(rules, f)
+        f.seek(0)
+        loaded = load_rules(f)
+
+        # JSON names are always strings
+        self.assertEqual([str(name) for name in rules], list(loaded))
+        for name, rule in rules.items():
+            loaded_rule = loaded[str(name)]
+            self.assertEqual(rule.dtree.structure_key(),
+                             loaded_rule.dtree.structure_key())
+            self.assertEqual(rule(calls), loaded_rule(calls))
+
+
+class TestWithoutDependencies(unittest.TestCase):
+    def test_load_and_score(self):
+        """Loading and scoring saved rules doesn't need pyparsing or NumPy"""
+        rules = {'asi2': ASI2('SCORE FROM ( 1I => 10, NOT 2L => 5 )'),
+                 'hcvr': HCVR('1!I AND TRUE')}
+        script = """\
+import sys
+sys.modules['pyparsing'] = sys.modules['numpy'] = None  # can't import
+from pyvdrm.bank import RuleBank
+from pyvdrm.ir import load_rules
+from pyvdrm.vcf import VariantCalls
+with open(sys.argv[1]) as f:
+    bank = RuleBank(load_rules(f))
+print(bank(VariantCalls(reference='AC' * 50, sample='IC' * 50)))
+"""
+        with TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'rules.json')
+            with open(path, 'w') as f:
+                dump_rules(rules, f)
+
+            output = subprocess.run([sys.executable, '-c', script, path],
+                                    cwd=PACKAGE_PARENT,
+                                    check=True,
+                                    stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+
+        self.assertEqual("{'asi2': 15, 'hcvr': False}\n", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import json
+import os
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from pyvdrm.hcvr import HCVR
+from pyvdrm.ir import dump_rules
+from pyvdrm.score import main, read_samples, score_samples
+from pyvdrm.vcf import VariantCalls
+
+RULES = {'score': 'SCORE FROM ( 1I => 10, 3R => 20 )',
+         'bool': '1I AND 3R'}
+
+
+class TestReadSamples(unittest.TestCase):
+    def test_fasta(self):
+        lines = StringIO('\n>reference\nACHE\n>sample1\nICRE\n')
+        expected_samples = [('sample1', VariantCalls('A1I C2C H3R E4E'))]
+
+        samples = list(read_samples(lines))
+
+        self.assertEqual(expected_samples, samples)
+
+    def test_tsv(self):
+        lines = StringIO('# sample\tmutations\nsample1\tA1I H3R\n')
+        expected_samples = [('sample1', VariantCalls('A1I H3R'))]
+
+        samples = list(read_samples(lines))
+
+        self.assertEqual(expected_samples, samples)
+
+    def test_format(self):
+        lines = StringIO('>sample1\nICRE\n')
+
+        with self.assertRaisesRegex(ValueError, r'Expected a sample id'):
+            list(read_samples(lines, sample_format='tsv'))
+
+    def test_empty(self):
+        self.assertEqual([], list(read_samples(StringIO(''))))
+
+
+class TestScoreSamples(unittest.TestCase):
+    samples = [('a', VariantCalls('A1I C2C H3R')),
+               ('b', VariantCalls('A1I C2C')),
+               ('c', VariantCalls('A1A C2C H3R'))]
+    expected_results = [{'sample': 'a', 'scores': {'score': 30, 'bool': True}},
+                        {'sample': 'b', 'error': 'Missing position 3.'},
+                        {'sample': 'c', 'scores': {'score': 20,
+                                                   'bool': False}}]
+
+    def test_in_process(self):
+        results = list(score_samples(RULES, iter(self.samples)))
+
+        self.assertEqual(self.expected_results, results)
+
+    def test_jobs(self):
+        results = list(score_samples(RULES, iter(self.samples), jobs=2))
+
+        self.assertEqual(self.expected_results, results)
+
+    def test_parser_class(self):
+        rules = {'score': RULES['score']}
+
+        results = list(score_samples(rules,
+                                     iter(self.samples[:1]),
+                                     parser_class=HCVR))
+
+        self.assertEqual([{'sample': 'a', 'scores': {'score': 30}}], results)
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.folder_context = TemporaryDirectory()
+        self.folder = self.folder_context.__enter__()
+
+    def tearDown(self):
+        self.folder_context.__exit__(None, None, None)
+
+    def write(self, name, text):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def run_main(self, *args):
+        stdout = StringIO()
+        with redirect_stdout(stdout):
+            main(list(args))
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_fasta(self):
+        rules_path = self.write('test.rules',
+                                '# comment\nscore\t{}\n1I AND 3R\n'.format(
+                                    RULES['score']))
+        samples_path = self.write('samples.fasta',
+                                  '>ref\nACHE\n>s1\nICRE\n>s2\nACRE\n')
+
+        results = self.run_main(rules_path, samples_path)
+
+        self.assertEqual([{'sample': 's1', 'scores': {'score': 30, '3': True}},
+                          {'sample': 's2', 'scores': {'score': 20,
+                                                      '3': False}}],
+                         results)
+
+    def test_reference(self):
+        rules_path = self.write('test.rules', '2L OR 4K\n')
+        reference_path = self.write('ref.fasta', '>ref\nACHE\n')
+        samples_path = self.write('samples.tsv', 's1\t2L 4K\ns2\t4A\n')
+
+        results = self.run_main(rules_path,
+                                samples_path,
+                                '--reference', reference_path,
+                                '--jobs', '2')
+
+        self.assertEqual([{'sample': 's1', 'scores': {'1': True}},
+                          {'sample': 's2', 'error': 'Missing position 2.'}],
+                         results)
+
+    def test_json_rules(self):
+        rules_path = os.path.join(self.folder, 'test.json')
+        with open(rules_path, 'w') as f:
+            dump_rules({'hcvr': HCVR('1!I AND TRUE')}, f)
+        samples_path = self.write('samples.tsv', 's1\t1I\ns2\t1A\n')
+
+        results = self.run_main(rules_path, samples_path)
+
+        self.assertEqual([{'sample': 's1', 'scores': {'hcvr': False}},
+                          {'sample': 's2', 'scores': {'hcvr': True}}],
+                         results)
+
+    def test_bad_json_rules(self):
+        rules_path = self.write('test.json', '{"version": 99, "rules": {}}')
+        samples_path = self.write('samples.tsv', 's1\t1I\n')
+
+        with self.assertRaisesRegex(
+                SystemExit,
+                r'^pyvdrm-score: Unsupported rule IR version: 99\.$'):
+            self.run_main(rules_path, samples_path)
+
+    def test_bad_input(self):
+        rules_path = self.write('test.rules', '2L OR 4K\n')
+        samples_path = self.write('samples.fasta', '>ref\nACHE\n>s1\nAC\n')
+
+        with self.assertRaisesRegex(
+                SystemExit,
+                r'pyvdrm-score: Reference length was 4 and sample length '
+                r'was 2\.'):
+            self.run_main(rules_path, samples_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
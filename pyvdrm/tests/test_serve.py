@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from pyvdrm.asi2 import ASI2
+from pyvdrm.bank import RuleBank
+from pyvdrm.ir import dump_rules
+from pyvdrm.serve import ScoringServer, load_bank
+from pyvdrm.vcf import VariantCalls
+
+RULES = {'score': 'SCORE FROM ( 1I => 10, 3R => 20 )',
+         'bool': '1I AND 3R'}
+
+
+def make_server():
+    hivdb = RuleBank({name: ASI2(rule) for name, rule in RULES.items()})
+    other = RuleBank({'other': ASI2('2L OR 4K')})
+    return ScoringServer({'test': hivdb, 'other': other})
+
+
+async def send_requests(reader, writer, requests):
+    """Send all the requests before reading any responses"""
+    for request in requests:
+        if isinstance(request, dict):
+            request = json.dumps(request)
+        writer.write(request.encode('utf8') + b'\n')
+    await writer.drain()
+    responses = []
+    for _ in requests:
+        line = await reader.readline()
+        responses.append(json.loads(line))
+    return responses
+
+
+class TestScoringServer(unittest.TestCase):
+    def test_score_mutations(self):
+        server = make_server()
+
+        response = server.score({'id': 7, 'bank': 'test',
+                                 'mutations': '1I 3R'})
+
+        self.assertEqual({'id': 7, 'scores': {'score': 30, 'bool': True}},
+                         response)
+
+    def test_score_sequence(self):
+        server = make_server()
+
+        response = server.score({'bank': 'other',
+                                 'reference': 'ACHE',
+                                 'sample': 'ALHE'})
+
+        self.assertEqual({'id': None, 'scores': {'other': True}}, response)
+
+    def test_errors(self):
+        server = make_server()
+
+        self.assertEqual(
+            {'id': 1, 'error': 'Missing position 3.'},
+            server.score({'id': 1, 'bank': 'test', 'mutations': '1I'}))
+        self.assertEqual(
+            {'id': 2, 'error': "Unknown rule bank: None."},
+            server.score({'id': 2, 'mutations': '1I'}))
+        self.assertEqual(
+            {'id': 3,
+             'error': 'Request needs mutations, or a reference and a sample.'},
+            server.score({'id': 3, 'bank': 'test'}))
+        self.assertEqual(
+            {'id': 4,
+             'error': 'Reference length was 4 and sample length was 3.'},
+            server.score({'id': 4, 'bank': 'other',
+                          'reference': 'ACHE', 'sample': 'ALH'}))
+        self.assertEqual(
+            {'id': 5, 'error': "Request field 'mutations' must be a string."},
+            server.score({'id': 5, 'bank': 'test', 'mutations': 5}))
+        self.assertEqual(
+            {'id': 6, 'error': "Request field 'bank' must be a string."},
+            server.score({'id': 6, 'bank': ['test'], 'mutations': '1I 3R'}))
+        self.assertEqual(
+            {'id': 7,
+             'error': "Request field 'sample' must be a string or a list of "
+                      "strings."},
+            server.score({'id': 7, 'bank': 'other',
+                          'reference': 'ACHE', 'sample': 1234}))
+
+    def test_invalid_json(self):
+        server = make_server()
+
+        response = json.loads(server.handle_line(b'{"id": 1,'))
+
+        self.assertIsNone(response['id'])
+        self.assertRegex(response['error'], r'^Invalid request: ')
+
+    def test_tcp_pipelining(self):
+        async def run():
+            server = await make_server().start(port=0)
+            host, port = server.sockets[0].getsockname()[:2]
+            async with server:
+                reader, writer = await asyncio.open_connection(host, port)
+                requests = [{'id': i, 'bank': 'test', 'mutations': mutations}
+                            for i, mutations in enumerate(['1I 3R',
+                                                           '1A 3R',
+                                                           '1A 3A',
+                                                           '1I'])]
+                requests.insert(2, 'not json')
+                requests.insert(4, {'id': 'wrong type',
+                                    'bank': 'test',
+                                    'mutations': 5})
+                responses = await send_requests(reader, writer, requests)
+                writer.close()
+            return responses
+
+        responses = asyncio.run(run())
+
+        self.assertEqual([{'id': 0, 'scores': {'score': 30, 'bool': True}},
+                          {'id': 1, 'scores': {'score': 20, 'bool': False}},
+                          None,
+                          {'id': 2, 'scores': {'score': 0, 'bool': False}},
+                          {'id': 'wrong type',
+                           'error': "Request field 'mutations' must be a "
+                                    "string."},
+                          {'id': 3, 'error': 'Missing position 3.'}],
+                         [None if response['id'] is None else response
+                          for response in responses])
+
+    def test_unix_socket_clients(self):
+        async def run(path):
+            server = await make_server().start(path=path)
+            async with server:
+                connections = [await asyncio.open_unix_connection(path)
+                               for _ in range(3)]
+                all_responses = await asyncio.gather(*(
+                    send_requests(reader,
+                                  writer,
+                                  [{'id': [i, j],
+                                    'bank': 'other',
+                                    'mutations': '2L 4A'}
+                                   for j in range(20)])
+                    for i, (reader, writer) in enumerate(connections)))
+                for _, writer in connections:
+                    writer.close()
+            return all_responses
+
+        with TemporaryDirectory() as folder:
+            all_responses = asyncio.run(run(os.path.join(folder, 'socket')))
+
+        for i, responses in enumerate(all_responses):
+            self.assertEqual([{'id': [i, j], 'scores': {'other': True}}
+                              for j in range(20)],
+                             responses)
+
+    def test_load_bank(self):
+        folder = os.path.dirname(__file__)
+        bank = load_bank(os.path.join(folder, 'HIVDB.rules'))
+
+        self.assertEqual(22, bank.info().rules)
+
+    def test_load_bank_json(self):
+        rules = {name: ASI2(rule) for name, rule in RULES.items()}
+        with TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'test.json')
+            with open(path, 'w') as f:
+                dump_rules(rules, f)
+
+            bank = load_bank(path)
+
+        self.assertEqual({'score': 30, 'bool': True},
+                         bank(VariantCalls('1I 3R')))
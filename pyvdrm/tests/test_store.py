@@ -0,0 +1,165 @@
+import os
+import pickle
+import unittest
+from tempfile import TemporaryDirectory
+
+from pyvdrm.cohort import evaluate_cohort
+from pyvdrm.vcf import VariantCalls
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # the store needs the numpy extra
+else:
+    from pyvdrm.store import (CohortStore, StoredCalls, load_calls,
+                              write_store)
+
+REFERENCE = 'ACHE'
+
+
+@unittest.skipUnless(np, 'NumPy is not installed.')
+class TestCohortStore(unittest.TestCase):
+    def setUp(self):
+        self.folder_context = TemporaryDirectory()
+        self.folder = self.folder_context.__enter__()
+        self.path = os.path.join(self.folder, 'cohort')
+
+    def tearDown(self):
+        self.folder_context.__exit__(None, None, None)
+
+    def write(self, samples):
+        return write_store(self.path, samples, REFERENCE)
+
+    def test_covered_samples(self):
+        samples = [('a', VariantCalls(reference=REFERENCE, sample='ICRE')),
+                   ('b', VariantCalls(reference=REFERENCE, sample='ACHE'))]
+
+        count = self.write(samples)
+        store = CohortStore(self.path)
+
+        self.assertEqual(2, count)
+        self.assertEqual(2, len(store))
+        self.assertEqual(['a', 'b'], store.sample_ids)
+        self.assertEqual(REFERENCE, store.reference)
+        for (_, expected_calls), calls in zip(samples, store):
+            self.assertEqual(expected_calls, calls)
+            self.assertEqual(set(expected_calls.positions),
+                             set(calls.positions))
+
+    def test_mutation_lists(self):
+        samples = [('a', VariantCalls('A1AI C2C H3R')),
+                   ('b', VariantCalls('H3HR E4d'))]
+
+        self.write(samples)
+        store = CohortStore(self.path)
+
+        self.assertEqual(samples[0][1], store[0])
+        self.assertEqual(samples[1][1], store[-1])
+        self.assertEqual('A1AI C2C H3R', str(store[0]))
+
+    def test_coverage(self):
+        self.write([('a', VariantCalls('A1I H3R E4E'))])
+        calls = CohortStore(self.path)[0]
+
+        self.assertEqual([1, 3, 4], list(calls.positions))
+        self.assertEqual(3, len(calls))
+        self.assertIsNone(calls.positions.get(2))
+        self.assertNotIn(2, calls.positions)
+        self.assertIn(3, calls.positions)
+        self.assertEqual('H3R', str(calls.positions[3]))
+
+    def test_view(self):
+        self.write([('a', VariantCalls(reference=REFERENCE, sample='ICRE'))])
+        store = CohortStore(self.path)
+
+        calls = store[0]
+
+        self.assertIsInstance(calls, StoredCalls)
+        self.assertIsInstance(store.masks, np.memmap)
+        self.assertTrue(np.shares_memory(store.masks, calls.positions.masks))
+
+    def test_pickle(self):
+        self.write([('a', VariantCalls('A1I')),
+                    ('b', VariantCalls(reference=REFERENCE, sample='ICRE'))])
+        calls = CohortStore(self.path)[1]
+
+        data = pickle.dumps(calls)
+        calls2 = pickle.loads(data)
+
+        self.assertLess(len(data), 200)
+        self.assertEqual(calls, calls2)
+        self.assertIs(load_calls(self.path, 0).positions.store,
+                      calls2.positions.store)
+
+    def test_evaluate_cohort(self):
+        rules = {'score': 'SCORE FROM ( 1I => 10, 3R => 20 )'}
+        samples = ['ICRE', 'ACHE', 'ICHE', 'ACRE']
+        self.write((str(i), VariantCalls(reference=REFERENCE, sample=sample))
+                   for i, sample in enumerate(samples))
+        expected_results = [{'score': 30},
+                            {'score': 0},
+                            {'score': 10},
+                            {'score': 20}]
+
+        for workers in (0, 2):
+            results = list(evaluate_cohort(rules,
+                                           CohortStore(self.path),
+                                           workers=workers,
+                                           chunksize=1))
+
+            self.assertEqual(expected_results, results)
+
+    def test_empty(self):
+        count = self.write([])
+        store = CohortStore(self.path)
+
+        self.assertEqual(0, count)
+        self.assertEqual([], list(store))
+        self.assertEqual([], store.sample_ids)
+
+    def test_index_error(self):
+        self.write([('a', VariantCalls('A1I'))])
+        store = CohortStore(self.path)
+
+        with self.assertRaisesRegex(IndexError,
+                                    r'Sample index 1 out of range\.'):
+            store[1]
+
+    def test_position_outside_reference(self):
+        with self.assertRaisesRegex(ValueError,
+                                    r'Position 5 is outside the reference\.'):
+            self.write([('a', VariantCalls('A1I E5K'))])
+
+    def test_wildtype_mismatch(self):
+        with self.assertRaisesRegex(
+                ValueError,
+                r'Wild type mismatch between C1I and reference A1\.'):
+            self.write([('a', VariantCalls('C1I'))])
+
+    def test_other_reference(self):
+        # same length as the store's reference, but not the same wild types
+        calls = VariantCalls(reference='ICHE', sample='ICRE')
+
+        with self.assertRaisesRegex(
+                ValueError,
+                r'Wild type mismatch between I1I and reference A1\.'):
+            self.write([('a', calls)])
+
+    def test_unknown_variant(self):
+        with self.assertRaisesRegex(ValueError, r'Only .* can be stored'):
+            self.write([('a', VariantCalls(reference=REFERENCE,
+                                           sample='ICR*'))])
+
+    def test_unknown_reference(self):
+        with self.assertRaisesRegex(ValueError,
+                                    r'not X in the reference\.'):
+            write_store(self.path, [], 'ACXE')
+
+    def test_unsupported_version(self):
+        self.write([])
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            f.write('{"version": 99}')
+
+        with self.assertRaisesRegex(ValueError,
+                                    r'Unsupported cohort store version: 99\.'):
+            CohortStore(self.path)
@@ -1,5 +1,11 @@
+import pickle
 import unittest
-from pyvdrm.vcf import Mutation, MutationSet, VariantCalls
+from io import StringIO
+
+from pyvdrm.vcf import (Mutation, MutationSet, VariantCalls, read_fasta,
+                        read_aligned_tsv, read_mutation_tsv, read_reference, InternTable, InternInfo,
+                        intern_mutation, intern_mutation_set, diff_positions,
+                        CoveredPositions)
 
 
 class TestMutation(unittest.TestCase):
@@ -83,6 +89,14 @@ class TestMutation(unittest.TestCase):
         with self.assertRaises(AttributeError):
             m.pos = 2
 
+    def test_pickle(self):
+        m = Mutation('Q1A')
+
+        m2 = pickle.loads(pickle.dumps(m))
+
+        self.assertEqual(m, m2)
+        self.assertEqual('Q', m2.wildtype)
+
 
 class TestMutationSet(unittest.TestCase):
     def test_init_text(self):
@@ -303,6 +317,60 @@ class TestMutationSet(unittest.TestCase):
         self.assertEqual(1, len(MutationSet('A10I')))
         self.assertEqual(2, len(MutationSet('A10IL')))
 
+    def test_mask(self):
+        ms1 = MutationSet('A10IL')
+        ms2 = MutationSet('A10LI')
+        ms3 = MutationSet('A10L')
+
+        self.assertEqual(ms1.mask, ms2.mask)
+        self.assertEqual(ms3.mask, ms1.mask & ms3.mask)
+        self.assertNotEqual(ms1.mask, ms3.mask)
+
+    def test_mask_negative(self):
+        expected_mask = MutationSet('Q1DEFGHIKLMNPQRSTVWY').mask
+
+        ms = MutationSet('Q1!AC')
+
+        self.assertEqual(expected_mask, ms.mask)
+
+    def test_mask_insertion_deletion(self):
+        ms1 = MutationSet('A10id')
+        ms2 = MutationSet('A10!K')
+
+        self.assertEqual(0, ms1.mask & ms2.mask)
+
+    def test_mask_other_symbols(self):
+        ms1 = MutationSet(wildtype='A', pos=10, variants='X*')
+        ms2 = MutationSet(wildtype='A', pos=10, variants='*')
+
+        self.assertEqual(ms2.mask, ms1.mask & ms2.mask)
+        self.assertEqual(0, ms1.mask & MutationSet('A10!K').mask)
+
+    def test_intersection(self):
+        ms1 = MutationSet('A10IL')
+        ms2 = MutationSet('10LMS')
+        expected_mutations = {Mutation('A10L')}
+
+        mutations = ms1.intersection(ms2)
+
+        self.assertEqual(expected_mutations, mutations)
+        self.assertEqual('A', next(iter(mutations)).wildtype)
+
+    def test_intersection_empty(self):
+        self.assertEqual(set(),
+                         MutationSet('A10IL').intersection(MutationSet('A10S')))
+        self.assertEqual(set(),
+                         MutationSet('A10IL').intersection(MutationSet('11I')))
+
+    def test_intersection_wildtype_mismatch(self):
+        ms1 = MutationSet('A10IL')
+        ms2 = MutationSet('C10L')
+
+        with self.assertRaisesRegex(ValueError,
+                                    r'Wild type mismatch between A10IL and '
+                                    r'C10L\.'):
+            ms1.intersection(ms2)
+
     def test_in(self):
         ms = MutationSet('A10IL')
 
@@ -311,6 +379,65 @@ class TestMutationSet(unittest.TestCase):
         self.assertIn(Mutation('10L'), ms)
         self.assertNotIn(Mutation('A10S'), ms)
 
+    def test_pickle(self):
+        ms = MutationSet('A10IL')
+
+        ms2 = pickle.loads(pickle.dumps(ms))
+
+        self.assertEqual(ms, ms2)
+        self.assertEqual('A', ms2.wildtype)
+        self.assertEqual(ms.mask, ms2.mask)
+
+    def test_pickle_negative(self):
+        ms = MutationSet('A10!d')
+
+        ms2 = pickle.loads(pickle.dumps(ms))
+
+        self.assertEqual(ms, ms2)
+        self.assertEqual(20, len(ms2))
+
+
+class TestFrequencies(unittest.TestCase):
+    def test_mutation_set(self):
+        mutation_set = MutationSet(pos=70,
+                                   wildtype='K',
+                                   frequencies={'K': 0.9, 'R': 0.1})
+
+        self.assertEqual(MutationSet('K70KR'), mutation_set)
+        self.assertEqual({'K': 0.9, 'R': 0.1}, mutation_set.frequencies)
+        self.assertIsNone(MutationSet('K70KR').frequencies)
+
+    def test_max_frequency(self):
+        mutation_set = MutationSet(pos=70,
+                                   wildtype='K',
+                                   frequencies={'K': 0.9, 'R': 0.1})
+
+        self.assertEqual(0.1, mutation_set.max_frequency(
+            MutationSet('70RE').mask))
+        self.assertEqual(0.9, mutation_set.max_frequency(
+            MutationSet('70KR').mask))
+        self.assertIsNone(mutation_set.max_frequency(MutationSet('70E').mask))
+        self.assertEqual(1.0, MutationSet('K70KR').max_frequency(
+            MutationSet('70R').mask))
+
+    def test_pickle(self):
+        mutation_set = MutationSet(pos=70,
+                                   wildtype='K',
+                                   frequencies={'K': 0.9, 'R': 0.1})
+
+        unpickled = pickle.loads(pickle.dumps(mutation_set))
+
+        self.assertEqual(mutation_set, unpickled)
+        self.assertEqual(mutation_set.frequencies, unpickled.frequencies)
+
+    def test_variant_calls(self):
+        calls = VariantCalls(reference='ACHE',
+                             sample=['A', {'C': 0.7, 'L': 0.3}, 'H', ''])
+
+        self.assertEqual(VariantCalls('A1A C2CL H3H'), calls)
+        self.assertEqual({'C': 0.7, 'L': 0.3}, calls.positions[2].frequencies)
+        self.assertIsNone(calls.positions[1].frequencies)
+
 
 class TestVariantCalls(unittest.TestCase):
     def test_init_text(self):
@@ -429,6 +556,113 @@ class TestVariantCalls(unittest.TestCase):
         self.assertEqual(1, len(VariantCalls('A10IL')))
         self.assertEqual(2, len(VariantCalls('A10IL H3R')))
 
+    def test_positions(self):
+        calls = VariantCalls('A1IL H3R')
+        expected_positions = {1: MutationSet('A1IL'), 3: MutationSet('H3R')}
+
+        self.assertEqual(expected_positions, calls.positions)
+
+    def test_positions_from_sequence(self):
+        calls = VariantCalls(reference='ACHE', sample=['IN', 'C', '', 'E'])
+
+        self.assertEqual([1, 2, 4], sorted(calls.positions))
+        self.assertEqual(MutationSet('A1IN'), calls.positions[1])
+
+    def test_parse_many(self):
+        expected_calls = [VariantCalls('A1IL H3R'),
+                          VariantCalls(''),
+                          VariantCalls('H3R')]
+
+        all_calls = VariantCalls.parse_many(['A1IL H3R', '', ' H3R '])
+
+        self.assertEqual(expected_calls, all_calls)
+        self.assertEqual([1, 3], sorted(all_calls[0].positions))
+        self.assertIs(all_calls[0].positions[3], all_calls[2].positions[3])
+
+    def test_parse_many_reference(self):
+        all_calls = VariantCalls.parse_many(['1IL 3R'], reference='ACHE')
+
+        self.assertEqual('ACHE', all_calls[0].reference)
+        self.assertEqual('A', all_calls[0].positions[1].wildtype)
+
+    def test_parse_many_duplicate_position(self):
+        with self.assertRaisesRegex(ValueError,
+                                    r'Multiple mutation sets at position 1\.'):
+            VariantCalls.parse_many(['A1IL H3R A1K'])
+
+    def test_parse_many_invalid_term(self):
+        with self.assertRaisesRegex(ValueError,
+                                    r'MutationSet text expects wild type'):
+            VariantCalls.parse_many(['A1IL 3'])
+
+    def test_parse_many_trusted(self):
+        all_calls = VariantCalls.parse_many(['A1IL H3R'], validate=False)
+
+        self.assertEqual([VariantCalls('A1IL H3R')], all_calls)
+        self.assertEqual([1, 3], sorted(all_calls[0].positions))
+
+    def test_covered_sequence(self):
+        expected_calls = VariantCalls('A1I C2C H3R E4E')
+
+        calls = VariantCalls(reference='ACHE', sample='ICRE')
+
+        self.assertIsInstance(calls.positions, CoveredPositions)
+        self.assertEqual(expected_calls, calls)
+        self.assertEqual(calls, expected_calls)
+        self.assertEqual(hash(expected_calls), hash(calls))
+        self.assertEqual(expected_calls.positions, calls.positions)
+        self.assertEqual(4, len(calls))
+        self.assertIn(MutationSet('C2C'), calls)
+        self.assertNotIn(MutationSet('C2A'), calls)
+        self.assertEqual('A1I C2C H3R E4E', str(calls))
+
+    def test_covered_positions(self):
+        positions = VariantCalls(reference='ACHE', sample='ICRE').positions
+
+        self.assertEqual([1, 3], positions.variant_positions)
+        self.assertEqual(MutationSet('C2C'), positions[2])
+        self.assertIs(positions[2], positions.get(2))
+        self.assertIsNone(positions.get(0))
+        self.assertIsNone(positions.get(5))
+        self.assertNotIn(5, positions)
+        with self.assertRaises(KeyError):
+            positions[5]
+
+    def test_covered_pickle(self):
+        calls = VariantCalls(reference='ACHE', sample='ICRE')
+
+        calls2 = pickle.loads(pickle.dumps(calls))
+
+        self.assertEqual(calls, calls2)
+        self.assertEqual('ICRE', calls2.positions.sample)
+
+    def test_diff_positions(self):
+        self.assertEqual([1, 3], diff_positions('ACHE', 'ICRE'))
+        self.assertEqual([], diff_positions('ACHE', 'ACHE'))
+
+    def test_diff_positions_not_ascii(self):
+        self.assertEqual([1, 4], diff_positions('ACH\u00c9', 'ICHE'))
+
+    def test_mutation_sets(self):
+        expected_calls = VariantCalls('A1IL H3R')
+
+        calls = VariantCalls(reference='ACHE',
+                             mutation_sets=[MutationSet('A1IL'),
+                                            MutationSet('H3R')])
+
+        self.assertEqual(expected_calls, calls)
+        self.assertEqual('ACHE', calls.reference)
+        self.assertEqual([1, 3], sorted(calls.positions))
+
+    def test_pickle(self):
+        calls = VariantCalls(reference='ACHE', sample=['IN', 'C', '', 'E'])
+
+        calls2 = pickle.loads(pickle.dumps(calls))
+
+        self.assertEqual(calls, calls2)
+        self.assertEqual('ACHE', calls2.reference)
+        self.assertEqual(calls.positions, calls2.positions)
+
     def test_immutable(self):
         calls = VariantCalls('A1IL H3R')
 
@@ -436,6 +670,186 @@ class TestVariantCalls(unittest.TestCase):
             calls.reference = 'ASH'
 
 
+class TestInternTable(unittest.TestCase):
+    def test_get(self):
+        table = InternTable()
+
+        ms1 = table.get('A10IL', MutationSet, 'A10IL')
+        ms2 = table.get('A10IL', MutationSet, 'A10IL')
+
+        self.assertIs(ms1, ms2)
+        self.assertEqual(MutationSet('A10IL'), ms1)
+        self.assertEqual(InternInfo(hits=1, misses=1, maxsize=65536, currsize=1),
+                         table.info())
+
+    def test_bounded(self):
+        table = InternTable(maxsize=2)
+
+        ms1 = table.get('A10I', MutationSet, 'A10I')
+        table.get('A11I', MutationSet, 'A11I')
+        table.get('A10I', MutationSet, 'A10I')
+        table.get('A12I', MutationSet, 'A12I')  # evicts A11I
+
+        self.assertIs(ms1, table.get('A10I', MutationSet, 'A10I'))
+        self.assertEqual(InternInfo(hits=2, misses=3, maxsize=2, currsize=2),
+                         table.info())
+
+    def test_disabled(self):
+        table = InternTable(maxsize=0)
+
+        ms1 = table.get('A10I', MutationSet, 'A10I')
+        ms2 = table.get('A10I', MutationSet, 'A10I')
+
+        self.assertIsNot(ms1, ms2)
+        self.assertEqual(ms1, ms2)
+        self.assertEqual(0, table.info().currsize)
+
+    def test_clear(self):
+        table = InternTable()
+        table.get('A10I', MutationSet, 'A10I')
+
+        table.clear()
+
+        self.assertEqual(InternInfo(hits=0, misses=0, maxsize=65536, currsize=0),
+                         table.info())
+
+    def test_shared_mutations(self):
+        ms1 = MutationSet('A10IL')
+        ms2 = MutationSet('A10I')
+        mutation = intern_mutation('A', 10, 'I')
+
+        self.assertIn(id(mutation), {id(m) for m in ms1})
+        self.assertIn(id(mutation), {id(m) for m in ms2})
+
+    def test_shared_mutation_sets(self):
+        calls1 = VariantCalls(reference='ACHE', sample='ICRE')
+        calls2 = VariantCalls(reference='ACHE', sample=['I', 'C', 'H', 'E'])
+
+        self.assertIs(calls1.positions[1], calls2.positions[1])
+        self.assertIs(intern_mutation_set(pos=1, variants='I', wildtype='A'),
+                      calls1.positions[1])
+        self.assertIsNot(calls1.positions[3], calls2.positions[3])
+
+    def test_pickle_shared(self):
+        ms = MutationSet('A10IL')
+
+        ms2 = pickle.loads(pickle.dumps(ms))
+        ms3 = pickle.loads(pickle.dumps(ms))
+
+        self.assertIs(ms2, ms3)
+
+
+class TestReadFasta(unittest.TestCase):
+    def test_reference_record(self):
+        fasta = StringIO("""\
+>reference
+ACHE
+>sample1
+ICRE
+>sample2 with description
+AC
+HE
+""")
+        expected_calls = [('sample1', VariantCalls('A1I C2C H3R E4E')),
+                          ('sample2 with description',
+                           VariantCalls('A1A C2C H3H E4E'))]
+
+        calls = list(read_fasta(fasta))
+
+        self.assertEqual(expected_calls, calls)
+        self.assertIs(calls[0][1].reference, calls[1][1].reference)
+        self.assertEqual('ACHE', calls[0][1].reference)
+
+    def test_reference_argument(self):
+        fasta = StringIO("""\
+>sample1
+ICRE
+""")
+        reference = 'ACHE'
+
+        calls = list(read_fasta(fasta, reference=reference))
+
+        self.assertEqual([('sample1', VariantCalls('A1I C2C H3R E4E'))],
+                         calls)
+        self.assertIs(reference, calls[0][1].reference)
+
+    def test_lazy(self):
+        lines = iter(['>reference\n', 'ACHE\n', '>sample1\n', 'ICRE\n',
+                      '>sample2\n', 'ACRE\n'])
+
+        calls = read_fasta(lines)
+        sample_id, _ = next(calls)
+
+        self.assertEqual('sample1', sample_id)
+        self.assertEqual(['ACRE\n'], list(lines))
+
+    def test_bad_length(self):
+        fasta = StringIO('>sample1\nICREL\n')
+
+        with self.assertRaisesRegex(
+                ValueError, r'Reference length was 4 and sample length was 5\.'):
+            list(read_fasta(fasta, reference='ACHE'))
+
+    def test_missing_header(self):
+        with self.assertRaisesRegex(ValueError,
+                                    r'FASTA sequence found before any header\.'):
+            list(read_fasta(StringIO('ACHE\n')))
+
+
+class TestReadAlignedTsv(unittest.TestCase):
+    def test_read(self):
+        tsv = StringIO("""\
+# sample\tsequence
+sample1\tICRE
+
+sample2\tACHE
+""")
+        reference = 'ACHE'
+        expected_calls = [('sample1', VariantCalls('A1I C2C H3R E4E')),
+                          ('sample2', VariantCalls('A1A C2C H3H E4E'))]
+
+        calls = list(read_aligned_tsv(tsv, reference))
+
+        self.assertEqual(expected_calls, calls)
+        self.assertIs(reference, calls[1][1].reference)
+
+
+class TestReadMutationTsv(unittest.TestCase):
+    def test_read(self):
+        tsv = StringIO("""\
+# sample\tmutations
+sample1\tA1I 3R
+
+sample2\t
+""")
+        expected_calls = [('sample1', VariantCalls('A1I H3R')),
+                          ('sample2', VariantCalls(''))]
+
+        calls = list(read_mutation_tsv(tsv, reference='ACHE'))
+
+        self.assertEqual(expected_calls, calls)
+
+    def test_missing_tab(self):
+        tsv = StringIO('sample1 1I 3R\n')
+
+        with self.assertRaisesRegex(
+                ValueError,
+                r"Expected a sample id and mutations, found 'sample1 1I 3R'\."):
+            list(read_mutation_tsv(tsv))
+
+
+class TestReadReference(unittest.TestCase):
+    def test_first_record(self):
+        fasta = StringIO('>ref\nAC\nHE\n>other\nICRE\n')
+
+        self.assertEqual('ACHE', read_reference(fasta))
+
+    def test_empty(self):
+        with self.assertRaisesRegex(ValueError,
+                                    r'No sequence found in reference FASTA\.'):
+            read_reference(StringIO(''))
+
+
 def add_mutations(text):
     """ Add a small set of mutations to an RT wild type. """
 
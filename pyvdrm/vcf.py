@@ -2,55 +2,403 @@
 Classes for dealing with amino acid mutation sets
 """
 import re
-from collections import namedtuple
+from collections import Counter, namedtuple, OrderedDict
+from collections.abc import Mapping, Set
 from operator import attrgetter
+from threading import Lock
+
+# NumPy is optional, and only imported when it's first needed
+_numpy = None  # the module, False if it isn't installed, or None if untried
 
 AMINO_ALPHABET = 'ACDEFGHIKLMNPQRSTVWY'
+AMINO_MASK = (1 << len(AMINO_ALPHABET)) - 1
+MUTATION_PATTERN = re.compile(r"([A-Z]?)(\d+)([idA-Z])")
+MUTATION_SET_PATTERN = re.compile(r"([A-Z]?)(\d+)(!)?([idA-Z]+)$")
+
+# one bit for each variant, other symbols get bits as they're found
+_variant_bits = {variant: 1 << i
+                 for i, variant in enumerate(AMINO_ALPHABET + 'id')}
+_variant_bits_lock = Lock()
+
+
+def variant_mask(variants):
+    """Bitmask with a bit set for each variant"""
+    mask = 0
+    for variant in variants:
+        bit = _variant_bits.get(variant)
+        if bit is None:
+            with _variant_bits_lock:
+                bit = _variant_bits.setdefault(variant,
+                                               1 << len(_variant_bits))
+        mask |= bit
+    return mask
+
+
+InternInfo = namedtuple('InternInfo', 'hits misses maxsize currsize')
+
+
+class InternTable(object):
+    """Bounded, thread-safe table of shared immutable objects, evicted by LRU
+
+    A cohort holds the same few mutations at every position over and over, so
+    equal objects are looked up here and shared instead of built again.
+    """
+
+    def __init__(self, maxsize=65536):
+        """ Initialize.
+
+        :param int maxsize: the most objects to keep, or zero to share nothing
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, factory, *args):
+        """Find the object for a key, or build it and add it to the table.
+
+        :param key: hashable description of the object
+        :param factory: builds the object from args when key isn't found
+        """
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        # build outside the lock, because building may intern other objects
+        return self.add(key, factory(*args))
+
+    def get_many(self, keys):
+        """Find the objects for many keys, with None for keys not found.
+
+        Missing objects can be built and then added with add().
+        """
+        values = []
+        with self._lock:
+            found = self._values.get
+            move_to_end = self._values.move_to_end
+            misses = 0
+            for key in keys:
+                value = found(key)
+                if value is None:
+                    misses += 1
+                else:
+                    move_to_end(key)
+                values.append(value)
+            self.hits += len(values) - misses
+            self.misses += misses
+        return values
+
+    def add(self, key, value):
+        """Add an object, unless an equal one was added first.
+
+        :return: the object that is in the table for key
+        """
+        if self.maxsize:
+            with self._lock:
+                value = self._values.setdefault(key, value)
+                while len(self._values) > self.maxsize:
+                    self._values.popitem(last=False)
+        return value
+
+    def info(self):
+        with self._lock:
+            return InternInfo(self.hits,
+                              self.misses,
+                              self.maxsize,
+                              len(self._values))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = self.misses = 0
+
+
+mutation_table = InternTable()
+mutation_set_table = InternTable()
+
+
+def intern_mutation(wildtype, pos, variant):
+    """Find an equal Mutation that has already been built, or build it"""
+    return mutation_table.get((wildtype, pos, variant),
+                              Mutation,
+                              None,
+                              wildtype,
+                              pos,
+                              variant)
+
+
+def intern_mutation_set(text=None,
+                        wildtype=None,
+                        pos=None,
+                        variants=None,
+                        reference=None):
+    """Find an equal MutationSet that has already been built, or build it
+
+    Takes the same arguments as MutationSet, except for mutations.
+    """
+    if variants is not None and not isinstance(variants, str):
+        variants = ''.join(variants)
+    return mutation_set_table.get((text, wildtype, pos, variants, reference),
+                                  MutationSet,
+                                  text,
+                                  wildtype,
+                                  pos,
+                                  variants,
+                                  None,
+                                  reference)
+
+
+def _index_positions(mutation_sets):
+    """ Index mutation sets by position.
+
+    Rules can then look up a residue without scanning the whole sample.
+    :raises ValueError: if there are multiple mutation sets at a position
+    """
+    positions = {mutation_set.pos: mutation_set
+                 for mutation_set in mutation_sets}
+    if len(positions) != len(mutation_sets):
+        counts = Counter(mutation_set.pos for mutation_set in mutation_sets)
+        pos = min(pos for pos, count in counts.items() if count > 1)
+        message = 'Multiple mutation sets at position {}.'.format(pos)
+        raise ValueError(message)
+    return positions
+
+
+def _import_numpy():
+    """Import NumPy the first time it's needed, or return False if it isn't
+        installed
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy
+
+
+def diff_positions(reference, sample):
+    """ Find where an aligned sample differs from its reference.
+
+    Uses NumPy to compare the whole sequences at once, when it's installed.
+    :param str reference: the wild-type reference
+    :param str sample: amino acids present at each position
+    :return: a list of positions, starting from 1
+    """
+    np = _import_numpy()
+    if np:
+        try:
+            reference_bytes = reference.encode('ascii')
+            sample_bytes = sample.encode('ascii')
+        except UnicodeEncodeError:
+            # other characters are compared one at a time below
+            pass
+        else:
+            reference_bytes = np.frombuffer(reference_bytes, np.uint8)
+            sample_bytes = np.frombuffer(sample_bytes, np.uint8)
+            return (np.flatnonzero(reference_bytes != sample_bytes) +
+                    1).tolist()
+    return [pos
+            for pos, (alt, ref) in enumerate(zip(sample, reference), 1)
+            if alt != ref]
+
+
+class CoveredPositions(Mapping):
+    """Positions of a sample that covers its whole reference
+
+    Only the variant positions are built up front. Wild-type MutationSets are
+    built the first time they are looked up.
+    """
+
+    def __init__(self, reference, sample):
+        """ Initialize.
+
+        :param str reference: the wild-type reference
+        :param str sample: amino acids present at each position, the same
+            length as reference
+        """
+        self.reference = reference
+        self.sample = sample
+        self.variant_positions = diff_positions(reference, sample)
+        self._mutation_sets = {pos: intern_mutation_set(pos=pos,
+                                                        variants=sample[pos-1],
+                                                        wildtype=reference[pos-1])
+                               for pos in self.variant_positions}
+
+    def get(self, pos, default=None):
+        mutation_set = self._mutation_sets.get(pos)
+        if mutation_set is None:
+            if not 0 < pos <= len(self.reference):
+                return default
+            wildtype = self.reference[pos-1]
+            mutation_set = intern_mutation_set(pos=pos,
+                                               variants=wildtype,
+                                               wildtype=wildtype)
+            self._mutation_sets[pos] = mutation_set
+        return mutation_set
+
+    def __getitem__(self, pos):
+        mutation_set = self.get(pos)
+        if mutation_set is None:
+            raise KeyError(pos)
+        return mutation_set
+
+    def __contains__(self, pos):
+        return isinstance(pos, int) and 0 < pos <= len(self.reference)
+
+    def __iter__(self):
+        return iter(range(1, len(self.reference) + 1))
+
+    def __len__(self):
+        return len(self.reference)
 
+    def __repr__(self):
+        return 'CoveredPositions({!r}, {!r})'.format(self.reference,
+                                                      self.sample)
+
+
+class CoveredMutationSets(Set):
+    """All the MutationSets of a sample, looked up from its positions"""
+
+    def __init__(self, positions):
+        """ Initialize.
 
-class VariantCalls(namedtuple('VariantCalls', 'mutation_sets reference')):
+        :param positions: a mapping that looks up each MutationSet, like
+            CoveredPositions
+        """
+        self.positions = positions
+
+    def __contains__(self, mutation_set):
+        found = self.positions.get(mutation_set.pos)
+        return found is not None and found == mutation_set
+
+    def __iter__(self):
+        get = self.positions.get
+        return (get(pos) for pos in self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __hash__(self):
+        # match the hash of an equal frozenset
+        return hash(frozenset(self))
+
+
+class VariantCalls(namedtuple('VariantCalls',
+                              'mutation_sets reference positions')):
     # TODO: remove all these __init__ methods once PyCharm bug is fixed.
     # https://youtrack.jetbrains.com/issue/PY-26834
     # noinspection PyUnusedLocal
-    def __init__(self, text=None, reference=None, sample=None):
+    def __init__(self,
+                 text=None,
+                 reference=None,
+                 sample=None,
+                 mutation_sets=None):
         """ Construct a set of Mutations given two aligned amino acid sequences
 
         :param str reference: the wild-type reference
         :param sample: amino acids present at each position, either a string or
-        a list of strings
+        a list of strings, or of dictionaries from each amino acid present to
+        its frequency
+        :param mutation_sets: MutationSet objects to use instead of text or
+            sample
+
+        The positions attribute maps each position to its MutationSet.
         """
         # noinspection PyArgumentList
         super().__init__()
 
-    def __new__(cls, text=None, reference=None, sample=None):
+    def __new__(cls, text=None, reference=None, sample=None,
+                mutation_sets=None):
         if text is not None:
             terms = text.split()
             mutation_sets = frozenset(
-                MutationSet(term, reference=reference)
+                intern_mutation_set(term, reference=reference)
                 for term in terms)
+        elif mutation_sets is not None:
+            mutation_sets = frozenset(mutation_sets)
         else:
             if len(reference) != len(sample):
                 raise ValueError(
                     'Reference length was {} and sample length was {}.'.format(
                         len(reference),
                         len(sample)))
-
-            mutation_sets = {MutationSet(pos=i, variants=alt, wildtype=ref)
+            if isinstance(sample, str):
+                # every position is covered, so only build the variants
+                positions = CoveredPositions(reference, sample)
+                # noinspection PyArgumentList
+                return super().__new__(
+                    cls,
+                    mutation_sets=CoveredMutationSets(positions),
+                    reference=reference,
+                    positions=positions)
+
+            mutation_sets = {MutationSet(pos=i,
+                                         wildtype=ref,
+                                         frequencies=alt)
+                             if isinstance(alt, dict)
+                             else intern_mutation_set(pos=i,
+                                                      variants=alt,
+                                                      wildtype=ref)
                              for i, (alt, ref) in enumerate(zip(sample,
                                                                 reference),
                                                             1)
                              if alt}
-        positions = set()
-        for mutation_set in mutation_sets:
-            if mutation_set.pos in positions:
-                message = 'Multiple mutation sets at position {}.'.format(
-                    mutation_set.pos)
-                raise ValueError(message)
-            positions.add(mutation_set.pos)
+        positions = _index_positions(mutation_sets)
         # noinspection PyArgumentList
         return super().__new__(cls,
                                mutation_sets=mutation_sets,
-                               reference=reference)
+                               reference=reference,
+                               positions=positions)
+
+    @classmethod
+    def parse_many(cls, texts, reference=None, validate=True):
+        """ Parse many mutation lists, like "41L 67N 70R 184V", at once.
+
+        Terms that were seen before are shared from the intern table without
+        being parsed again.
+        :param texts: an iterable of mutation list strings
+        :param str reference: alternative source for wild types
+        :param bool validate: False skips checking for multiple mutation sets
+            at a position, for trusted input
+        :return: a list of VariantCalls
+        """
+        all_calls = []
+        for text in texts:
+            terms = text.split()
+            keys = [(term, None, None, None, reference) for term in terms]
+            mutation_sets = mutation_set_table.get_many(keys)
+            for i, mutation_set in enumerate(mutation_sets):
+                if mutation_set is None:
+                    mutation_sets[i] = mutation_set_table.add(
+                        keys[i],
+                        MutationSet(terms[i], reference=reference))
+            mutation_sets = frozenset(mutation_sets)
+            if validate:
+                positions = _index_positions(mutation_sets)
+            else:
+                positions = {mutation_set.pos: mutation_set
+                             for mutation_set in mutation_sets}
+            # skip __new__, which would check the positions again
+            all_calls.append(tuple.__new__(cls, (mutation_sets,
+                                                 reference,
+                                                 positions)))
+        return all_calls
+
+    def __reduce__(self):
+        if isinstance(self.positions, CoveredPositions):
+            return VariantCalls, (None, self.reference, self.positions.sample)
+        # positions is rebuilt from the mutation sets
+        return VariantCalls, (None,
+                              self.reference,
+                              None,
+                              tuple(self.mutation_sets))
 
     def __str__(self):
         return ' '.join(map(str, sorted(self.mutation_sets,
@@ -84,7 +432,7 @@ class Mutation(namedtuple('Mutation', 'pos variant wildtype')):
 
     def __new__(cls, text=None, wildtype=None, pos=None, variant=None):
         if text is not None:
-            match = re.match(r"([A-Z]?)(\d+)([idA-Z])", text)
+            match = MUTATION_PATTERN.match(text)
             if match is None:
                 raise ValueError('Mutation text expects wild type (optional), '
                                  'position, and one variant.')
@@ -114,6 +462,9 @@ class Mutation(namedtuple('Mutation', 'pos variant wildtype')):
         # noinspection PyArgumentList
         super().__init__()
 
+    def __reduce__(self):
+        return intern_mutation, (self.wildtype, self.pos, self.variant)
+
     def __repr__(self):
         text = str(self)
         return "Mutation({!r})".format(text)
@@ -124,6 +475,8 @@ class Mutation(namedtuple('Mutation', 'pos variant wildtype')):
         return text
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if self.pos != other.pos:
             return False
 
@@ -145,7 +498,8 @@ class Mutation(namedtuple('Mutation', 'pos variant wildtype')):
         return hash((self.pos, self.variant))
 
 
-class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
+class MutationSet(namedtuple('MutationSet',
+                             'pos mutations wildtype mask frequencies')):
     """Handle sets of mutations at a position"""
 
     def __new__(cls,
@@ -154,10 +508,14 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
                 pos=None,
                 variants=None,
                 mutations=None,
-                reference=None):
+                reference=None,
+                frequencies=None):
         negative = None
+        if frequencies is not None:
+            frequencies = dict(frequencies)
+            variants = ''.join(frequencies)
         if text:
-            match = re.match(r"([A-Z]?)(\d+)(!)?([idA-Z]+)$", text)
+            match = MUTATION_SET_PATTERN.match(text)
             if match is None:
                 message = 'MutationSet text expects wild type (optional), ' \
                           'position, and one or more variants.'
@@ -168,17 +526,19 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
                 wildtype = reference[int(pos)-1]
 
         if variants:
+            mask = variant_mask(variants)
             if negative:
                 original_variants = variants
                 variants = (c
                             for c in AMINO_ALPHABET
                             if c not in original_variants)
-            mutations = frozenset(Mutation(wildtype=wildtype,
-                                           pos=pos,
-                                           variant=variant)
+                mask = AMINO_MASK & ~mask
+            pos = int(pos)
+            mutations = frozenset(intern_mutation(wildtype, pos, variant)
                                   for variant in variants)
         else:
             mutations = frozenset(mutations or tuple())
+            mask = variant_mask(mutation.variant for mutation in mutations)
             positions = {mutation.pos for mutation in mutations}
             wildtypes = {mutation.wildtype for mutation in mutations}
             if pos is not None:
@@ -204,7 +564,9 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
         return super().__new__(cls,
                                wildtype=wildtype or None,
                                pos=int(pos),
-                               mutations=mutations)
+                               mutations=mutations,
+                               mask=mask,
+                               frequencies=frequencies)
 
     # noinspection PyUnusedLocal
     def __init__(self,
@@ -213,7 +575,8 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
                  pos=None,
                  variants=None,
                  mutations=None,
-                 reference=None):
+                 reference=None,
+                 frequencies=None):
         """ Initialize
 
         :param str text: will be parsed for wildtype (optional), position,
@@ -226,6 +589,13 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
             positions and wild types
         :param str reference: alternative source for wildtype, based on
             pos - 1
+        :param dict frequencies: the fraction of reads with each variant,
+            like {'K': 0.9, 'R': 0.1}, instead of variants
+
+        The mask attribute has a bit set for each variant, so sets at the
+        same position can be intersected without comparing Mutations.
+        Frequencies are only used when scoring at thresholds, and don't
+        change equality.
         """
         # noinspection PyArgumentList
         super().__init__()
@@ -237,6 +607,8 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
         return call in self.mutations
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if self.pos != other.pos:
             return False
         if self.wildtype is not None and other.wildtype is not None:
@@ -246,7 +618,7 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
                 message = 'Wild type mismatch between {} and {}.'.format(self,
                                                                          other)
                 raise ValueError(message)
-        return self.mutations == other.mutations
+        return self.mask == other.mask
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -257,6 +629,57 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
     def __iter__(self):
         return iter(self.mutations)
 
+    def __reduce__(self):
+        # variant bits can differ between processes, so the mask is rebuilt
+        if self.frequencies is not None:
+            return MutationSet, (None,
+                                 self.wildtype,
+                                 self.pos,
+                                 None,
+                                 None,
+                                 None,
+                                 self.frequencies)
+        variants = ''.join(mutation.variant for mutation in self.mutations)
+        if not variants:
+            return intern_mutation_set, (None, self.wildtype, self.pos)
+        return intern_mutation_set, (None, self.wildtype, self.pos, variants)
+
+    def max_frequency(self, mask):
+        """ Find the highest frequency of the variants in a bitmask.
+
+        :param int mask: bits for the variants to check, like another
+            MutationSet's mask
+        :return: the highest frequency, 1.0 if this set has no frequencies,
+            or None if none of the variants are in this set
+        """
+        if not mask & self.mask:
+            return None
+        if self.frequencies is None:
+            return 1.0
+        return max(frequency
+                   for variant, frequency in self.frequencies.items()
+                   if _variant_bits[variant] & mask)
+
+    def intersection(self, other):
+        """Find the Mutations in this set whose variants are also in other.
+
+        :param MutationSet other: compared by bitmask, so its Mutations are
+            never compared one by one
+        :return: a frozenset of this set's Mutations
+        """
+        mask = self.mask & other.mask
+        if not mask or self.pos != other.pos:
+            return frozenset()
+        if self.wildtype is not None and other.wildtype is not None:
+            # if the wt is specified for both sets, they must match
+            if self.wildtype != other.wildtype:
+                message = 'Wild type mismatch between {} and {}.'.format(self,
+                                                                         other)
+                raise ValueError(message)
+        return frozenset(mutation
+                         for mutation in self.mutations
+                         if _variant_bits[mutation.variant] & mask)
+
     def __str__(self):
         text = self.wildtype or ''
         text += str(self.pos)
@@ -273,3 +696,90 @@ class MutationSet(namedtuple('MutationSet', 'pos mutations wildtype')):
     def __repr__(self):
         text = str(self)
         return 'MutationSet({!r})'.format(text)
+
+
+def _read_fasta_records(lines):
+    """Yield (header, sequence) for each record, holding one at a time"""
+    header = None
+    sequence = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('>'):
+            if header is not None:
+                yield header, ''.join(sequence)
+            header = line[1:].strip()
+            sequence = []
+        elif line:
+            if header is None:
+                raise ValueError('FASTA sequence found before any header.')
+            sequence.append(line)
+    if header is not None:
+        yield header, ''.join(sequence)
+
+
+def read_fasta(lines, reference=None):
+    """ Read aligned amino acid sequences from a multi-FASTA file.
+
+    Samples are read one at a time, so the whole file is never in memory.
+    :param lines: an open file, or any other iterable of lines
+    :param str reference: the wild-type reference aligned with every sample,
+        or None to use the first record as the reference
+    :return: a generator of (sample_id, VariantCalls), all sharing the same
+        reference string
+    """
+    for sample_id, sequence in _read_fasta_records(lines):
+        if reference is None:
+            reference = sequence
+            continue
+        yield sample_id, VariantCalls(reference=reference, sample=sequence)
+
+
+def read_aligned_tsv(lines, reference):
+    """ Read aligned amino acid sequences from a tab-separated file.
+
+    Each line has a sample id and its aligned sequence. Blank lines and lines
+    that start with # are skipped.
+    :param lines: an open file, or any other iterable of lines
+    :param str reference: the wild-type reference aligned with every sample
+    :return: a generator of (sample_id, VariantCalls), all sharing the same
+        reference string
+    """
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        sample_id, sequence = line.split('\t')
+        yield sample_id, VariantCalls(reference=reference,
+                                      sample=sequence.strip())
+
+
+def read_reference(lines):
+    """ Read the first sequence from a FASTA file.
+
+    :param lines: an open file, or any other iterable of lines
+    :return: the sequence string
+    """
+    for _, sequence in _read_fasta_records(lines):
+        return sequence
+    raise ValueError('No sequence found in reference FASTA.')
+
+
+def read_mutation_tsv(lines, reference=None):
+    """ Read mutation lists from a tab-separated file.
+
+    Each line has a sample id and its mutation list, like "41L 67N 70R".
+    Blank lines and lines that start with # are skipped.
+    :param lines: an open file, or any other iterable of lines
+    :param str reference: alternative source for wild types
+    :return: a generator of (sample_id, VariantCalls)
+    """
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        sample_id, tab, text = line.partition('\t')
+        if not tab:
+            raise ValueError(
+                'Expected a sample id and mutations, found {!r}.'.format(line))
+        calls, = VariantCalls.parse_many([text], reference)
+        yield sample_id, calls
@@ -10,8 +10,11 @@ setup(
     author_email='',
 
     packages=(['pyvdrm']),
-    python_requires='>=3',
+    python_requires='>=3.7',
     install_requires=['pyparsing'],
+    extras_require={'numpy': ['numpy']},
+    entry_points={
+        'console_scripts': ['pyvdrm-score = pyvdrm.score:main']},
 
     setup_requires=['pytest-runner'],
     tests_require=['pytest'])